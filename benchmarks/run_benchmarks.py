@@ -0,0 +1,285 @@
+# Benchmark harness of the metric engines on synthetic projects of growing size.
+# Every engine runs in its own child process so that its wall time, CPU time and peak
+# RSS (children included) are measured separately, through the telemetry module of the
+# mining pipeline. The results are appended to <out>/results.jsonl and summarized with
+# the scaling exponent of every engine, e.g. 1.0 when the time grows linearly with the
+# number of commits and 2.0 when it grows quadratically.
+#
+#   python benchmarks/run_benchmarks.py --sizes 100,500,2000
+#   python benchmarks/run_benchmarks.py --sizes 100,500 --engines calc_2,comm_own --baseline old.jsonl
+#
+#   python benchmarks/run_benchmarks.py --sizes 400 --merge-ratio 0.05 --compare
+#
+# With --baseline, the exit status is 1 when an engine got slower than the baseline by
+# more than --tolerance, or scales worse than --max-exponent. With --compare, it is also 1
+# when the fused engine saved other metrics than the separate engines; --merge-ratio gives
+# the projects side branches and merges, where the orders of git log and of the commit
+# catalog differ.
+
+import argparse
+import importlib.util
+import json
+import math
+import os
+import shutil
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCHMARKS_DIR, '..')
+# The shared helpers live at the root of the repository
+sys.path.append(ROOT_DIR)
+import telemetry
+from synthetic_repo import generate_project
+
+ENGINES = ['collect', 'calc_1b', 'calc_2', 'comm_own', 'fused']
+# Exit status of an engine that cannot run because a dependency is not installed
+SKIPPED = 3
+
+
+def load_script(name, path):
+    # Load a script by path, e.g. the ones with a hyphen in their file name
+    folder = os.path.dirname(path)
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_collect(info, workdir):
+    csc = load_script('csc_refactdrill', os.path.join(ROOT_DIR, 'csc-refactdrill.py'))
+    os.makedirs(os.path.join(workdir, info['name']))
+    shutil.copy(os.path.join(info['project_path'], 'refactorings.json'), os.path.join(workdir, info['name']))
+    csc.git_root = os.path.dirname(info['repo_path'])
+    os.chdir(workdir)
+    csc.collect_refactoring_commits(info['name'])
+
+
+def run_calc_1b(info, workdir):
+    calc_1b = load_script('calc_1b_metrics', os.path.join(ROOT_DIR, 'metrics-minor-sexp', 'calc_1b_metrics.py'))
+    metrics = calc_1b.process_repo(info['repo_path'], os.path.join(info['project_path'], 'only_refactorings.json'))
+    calc_1b.save_metrics(metrics, os.path.join(workdir, 'part_1b_metrics.json'))
+
+
+def run_calc_2(info, workdir):
+    calc_2 = load_script('calc_2_metrics', os.path.join(ROOT_DIR, 'metrics-minor-sexp', 'calc_2_metrics.py'))
+    metrics = calc_2.analyze_repository(info['repo_path'], os.path.join(info['project_path'], 'only_refactorings.json'))
+    calc_2.save_metrics(metrics, os.path.join(workdir, 'part_2_metrics.json'))
+
+
+def run_comm_own(info, workdir):
+    comm_own = load_script('metrics_comm_own', os.path.join(ROOT_DIR, 'metrics-COMM-OWN', 'metrics-comm-own.py'))
+    # The script writes its output next to its inputs, so work on a copy of them
+    project_path = os.path.join(workdir, info['name'])
+    shutil.copytree(info['project_path'], project_path)
+    comm_own.GIT_ROOT = os.path.dirname(info['repo_path'])
+    comm_own.process_repository(project_path, info['name'])
+
+
+def run_fused(info, workdir):
+    fused = load_script('fused_metrics', os.path.join(ROOT_DIR, 'metrics-minor-sexp', 'fused_metrics.py'))
+    # COMM-OWN writes its output next to its inputs, so work on a copy of them
+    project_path = os.path.join(workdir, info['name'])
+    shutil.copytree(info['project_path'], project_path)
+    fused.run_fused(info['repo_path'], os.path.join(project_path, 'only_refactorings.json'), workdir)
+
+
+RUNNERS = {
+    'collect': run_collect,
+    'calc_1b': run_calc_1b,
+    'calc_2': run_calc_2,
+    'comm_own': run_comm_own,
+    'fused': run_fused,
+}
+
+
+def run_engine(engine, dataset, workdir):
+    # Entry point of the child process
+    with open(os.path.join(dataset, 'synthetic.json'), 'r') as file:
+        info = json.load(file)
+    info['repo_path'] = os.path.abspath(info['repo_path'])
+    info['project_path'] = os.path.abspath(info['project_path'])
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir)
+    try:
+        RUNNERS[engine](info, os.path.abspath(workdir))
+    except ImportError as e:
+        print(f"Skipping {engine}: {e}")
+        sys.exit(SKIPPED)
+
+
+def dataset_name(commits, seed, merge_ratio=0.0):
+    return f"synthetic_c{commits}_s{seed}" + (f"_m{merge_ratio:g}" if merge_ratio else "")
+
+
+def dataset_for(out, commits, seed, merge_ratio=0.0):
+    # Projects are generated once per size, seed and merge ratio, then reused by later runs
+    name = dataset_name(commits, seed, merge_ratio)
+    dataset = os.path.join(out, 'data', name)
+    if not os.path.exists(os.path.join(dataset, 'synthetic.json')):
+        print(f"Generating {name}")
+        generate_project(os.path.join(out, 'data'), name, commits=commits, files=max(10, commits // 5),
+                         authors=min(50, max(3, commits // 50)), packages=max(2, commits // 200), seed=seed,
+                         merge_ratio=merge_ratio)
+    return dataset
+
+
+def benchmark(out, sizes, engines, seed=0, merge_ratio=0.0):
+    """
+    Run every engine on a synthetic project of every size
+    Input: out: str, folder of the datasets, the engine outputs and results.jsonl
+           sizes: list of int, number of commits of the projects
+           engines: list of str, names from ENGINES
+           seed: int
+           merge_ratio: float, see synthetic_repo.generate_project (0 gives linear histories)
+    Output: list of dict, the telemetry records of the runs
+    """
+    os.makedirs(out, exist_ok=True)
+    telemetry.TELEMETRY_FILE = os.path.join(out, 'results.jsonl')
+    records = []
+    for commits in sizes:
+        dataset = dataset_for(out, commits, seed, merge_ratio)
+        for engine in engines:
+            workdir = os.path.join(out, 'runs', f"{engine}_c{commits}")
+            log_file = os.path.join(out, 'runs', f"{engine}_c{commits}.log")
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            with telemetry.stage(f"c{commits}", engine, commits=commits, seed=seed,
+                                 run=time.strftime('%Y-%m-%dT%H:%M:%S')) as record:
+                with open(log_file, 'w') as log:
+                    exit_code = telemetry.call([sys.executable, os.path.abspath(__file__), '--engine', engine,
+                                                '--dataset', dataset, '--workdir', workdir],
+                                               stdout=log, stderr=log)
+                record['status'] = 'ok' if exit_code == 0 else 'skipped' if exit_code == SKIPPED else 'failed'
+            print(f"{engine:<10} {commits:>7} commits  {record['status']:<8} {record['wall_s']:>9.2f} s "
+                  f"{record['child_peak_rss_mb']:>9.1f} MB")
+            records.append(record)
+    return records
+
+
+def compare_outputs(out, records, seed=0, merge_ratio=0.0):
+    """
+    Check that the fused engine saved the same metrics as the separate engines, for every size
+    they both ran on
+    Input: out, seed, merge_ratio: same as given to benchmark
+           records: list of dict, from benchmark
+    Output: list of str, the outputs that differ
+    """
+    ok = {(record['stage'], record['commits']) for record in records if record['status'] == 'ok'}
+    mismatches = []
+    for commits in sorted({record['commits'] for record in records}):
+        if ('fused', commits) not in ok:
+            continue
+        fused_dir = os.path.join(out, 'runs', f"fused_c{commits}")
+        name = dataset_name(commits, seed, merge_ratio)
+        pairs = {
+            'calc_1b': (f"{name}-part_1b_metrics.json", 'part_1b_metrics.json'),
+            'calc_2': (f"{name}-part_2_metrics.json", 'part_2_metrics.json'),
+            'comm_own': (os.path.join(name, f"{name}_metrics.json"), os.path.join(name, f"{name}_metrics.json")),
+        }
+        for engine, (fused_file, separate_file) in pairs.items():
+            if (engine, commits) not in ok:
+                continue
+            with open(os.path.join(fused_dir, fused_file), 'rb') as file:
+                fused = file.read()
+            with open(os.path.join(out, 'runs', f"{engine}_c{commits}", separate_file), 'rb') as file:
+                separate = file.read()
+            status = 'same' if fused == separate else 'DIFFERENT'
+            print(f"fused vs {engine:<10} {commits:>7} commits  {status}")
+            if fused != separate:
+                mismatches.append(f"fused and {engine} metrics differ at {commits} commits")
+    return mismatches
+
+
+def scaling_exponent(points):
+    # Slope of log(time) against log(commits) between the smallest and the largest run
+    points = sorted(points)
+    (n1, t1), (n2, t2) = points[0], points[-1]
+    if n1 == n2 or t1 <= 0 or t2 <= 0:
+        return None
+    return math.log(t2 / t1) / math.log(n2 / n1)
+
+
+def report(records, baseline=None, tolerance=0.25, max_exponent=None):
+    """
+    Print the results and return the list of regressions found
+    Input: records: list of dict, from benchmark
+           baseline: list of dict or None, records of an earlier run
+           tolerance: float, allowed slowdown against the baseline (0.25 = 25 %)
+           max_exponent: float or None, highest accepted scaling exponent
+    Output: list of str
+    """
+    regressions = []
+    reference = {}
+    for record in baseline or []:
+        if record.get('status') == 'ok':
+            reference[(record['stage'], record['commits'])] = record
+
+    for engine in ENGINES:
+        runs = [record for record in records if record['stage'] == engine and record['status'] == 'ok']
+        if not runs:
+            continue
+        print(f"\n{engine}")
+        for record in sorted(runs, key=lambda record: record['commits']):
+            line = (f"  {record['commits']:>7} commits {record['wall_s']:>9.2f} s wall "
+                    f"{record['child_cpu_s']:>9.2f} s CPU {record['child_peak_rss_mb']:>9.1f} MB peak RSS")
+            previous = reference.get((engine, record['commits']))
+            if previous and previous['wall_s'] > 0:
+                ratio = record['wall_s'] / previous['wall_s']
+                line += f"  x{ratio:.2f} vs baseline"
+                if ratio > 1 + tolerance:
+                    regressions.append(f"{engine} at {record['commits']} commits is {ratio:.2f} times slower than the baseline")
+            print(line)
+        exponent = scaling_exponent([(record['commits'], record['wall_s']) for record in runs])
+        if exponent is not None:
+            print(f"  scaling exponent {exponent:.2f}")
+            if max_exponent is not None and exponent > max_exponent:
+                regressions.append(f"{engine} scales with an exponent of {exponent:.2f} (max {max_exponent})")
+
+    for regression in regressions:
+        print("REGRESSION:", regression)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the metric engines on synthetic projects")
+    parser.add_argument('--sizes', default='100,500,2000', help="comma separated numbers of commits")
+    parser.add_argument('--engines', default=','.join(ENGINES), help="comma separated engines: " + ', '.join(ENGINES))
+    parser.add_argument('--out', default='benchmark_output', help="folder of the datasets and results")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--merge-ratio', type=float, default=0.0,
+                        help="chance for a commit to fork a side branch merged back later (0 = linear history)")
+    parser.add_argument('--compare', action='store_true',
+                        help="fail when the fused engine saves other metrics than the separate engines")
+    parser.add_argument('--baseline', help="results.jsonl of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--max-exponent', type=float)
+    # Used by the harness itself to run one engine in a child process
+    parser.add_argument('--engine', help=argparse.SUPPRESS)
+    parser.add_argument('--dataset', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.engine:
+        run_engine(args.engine, args.dataset, args.workdir)
+        return
+
+    engines = [engine for engine in args.engines.split(',') if engine]
+    unknown = [engine for engine in engines if engine not in RUNNERS]
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(unknown)}")
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    # Read the baseline first, it may be the results.jsonl this run appends to
+    baseline = telemetry.load_records(args.baseline) if args.baseline else None
+    records = benchmark(args.out, sizes, engines, args.seed, args.merge_ratio)
+    regressions = report(records, baseline, args.tolerance, args.max_exponent)
+    if args.compare:
+        regressions += compare_outputs(args.out, records, args.seed, args.merge_ratio)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# Deterministic generator of synthetic Java projects for the benchmarks.
+# A project is a local git repository written with a single `git fast-import`, plus the
+# files the pipeline would have produced for it: a RefactoringMiner-like refactorings.json,
+# only_refactorings.json and commits.json. The same parameters and seed always give the
+# same commit hashes, so timings of different runs are comparable.
+#
+# Layout of a generated project under <dest>:
+#   <dest>/repos/<name>/                  the git repository
+#   <dest>/<name>/refactorings.json       every commit, newest first, like RefactoringMiner -a
+#   <dest>/<name>/only_refactorings.json  the commits with refactorings
+#   <dest>/<name>/commits.json            the entries csc-refactdrill.py collects for them
+
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+
+# The shared helpers live at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from git_log_parser import iter_log
+from refactorings_reader import JsonArrayWriter, filter_refactorings
+import commits_store
+
+START_TIMESTAMP = 1500000000
+REFACTORING_TYPES = ['Extract Method', 'Rename Method', 'Move Class', 'Rename Variable',
+                     'Extract Variable', 'Inline Method', 'Move Method', 'Change Return Type']
+
+
+class _Project:
+    """State of the files while the history is generated."""
+
+    def __init__(self, rng, packages, package_depth):
+        self.rng = rng
+        self.files = {}   # path -> list of body lines
+        self.counter = 0
+        self.packages = []
+        for i in range(packages):
+            parts = ['com', 'example'] + [f'p{i}'] + [f'sub{rng.randrange(3)}' for _ in range(package_depth - 1)]
+            self.packages.append('/'.join(parts))
+
+    def new_path(self):
+        self.counter += 1
+        package = self.rng.choice(self.packages)
+        return f"src/main/java/{package}/Class{self.counter}.java"
+
+    def new_line(self):
+        self.counter += 1
+        return f"    int field{self.counter} = {self.rng.randrange(1000)};"
+
+    def content(self, path):
+        # A compilable-looking class around the body lines
+        package = os.path.dirname(path)[len('src/main/java/'):].replace('/', '.')
+        name = os.path.basename(path)[:-len('.java')]
+        lines = [f"package {package};", "", f"public class {name} {{"] + self.files[path] + ["}", ""]
+        return '\n'.join(lines).encode('utf-8')
+
+
+def _data(payload):
+    return b'data ' + str(len(payload)).encode() + b'\n' + payload + b'\n'
+
+
+def _history(rng, commits, files, authors, packages, package_depth, rename_ratio, delete_ratio, merge_ratio=0.0):
+    # Yield the fast-import stream of the whole history
+    project = _Project(rng, packages, package_depth)
+    # Skewed authorship so that some developers own most of the code, like real projects
+    developers = [(f"Developer {i}", f"dev{i}@example.com") for i in range(authors)]
+    weights = [1 / (i + 1) for i in range(authors)]
+    timestamp = START_TIMESTAMP
+    # Mark of the last commit of master, and the side branch when one is open:
+    # {'tip': mark, 'touched': paths written on it, 'deleted': paths removed on it}
+    master = 0
+    side = None
+
+    for i in range(commits):
+        name, email = rng.choices(developers, weights)[0]
+        timestamp += rng.randint(600, 2 * 86400)
+        operations = []
+        touched = []
+        identity = f"{name} <{email}> {timestamp} +0000".encode('utf-8')
+        mark = b'mark :' + str(i + 1).encode() + b'\n'
+
+        # The side branch is merged a few commits after it was forked, at the latest by the last commit
+        if side is not None and side['tip'] and (rng.random() < 0.2 or i == commits - 1):
+            # Merge the side branch into master. Master's tree misses what was done on the side
+            # branch, so the merge writes it, and its tree is the current state of the files again
+            for path in sorted(side['touched']):
+                if path in project.files:
+                    operations.append(b'M 100644 inline ' + path.encode() + b'\n' + _data(project.content(path)))
+            for path in sorted(side['deleted']):
+                if path not in project.files:
+                    operations.append(b'D ' + path.encode() + b'\n')
+            message = b"Merge side branch into master\n"
+            yield (b'commit refs/heads/master\n' + mark
+                   + b'author ' + identity + b'\n'
+                   + b'committer ' + identity + b'\n'
+                   + _data(message)
+                   + b'from :' + str(master).encode() + b'\n'
+                   + b'merge :' + str(side['tip']).encode() + b'\n'
+                   + b''.join(operations)
+                   + b'\n')
+            master = i + 1
+            side = None
+            continue
+        if merge_ratio and side is None and i > 0 and rng.random() < merge_ratio:
+            # Fork a side branch from master, its commits are interleaved with those of master
+            side = {'fork': master, 'tip': None, 'touched': set(), 'deleted': set()}
+        on_side = side is not None and rng.random() < 0.5
+
+        live = sorted(project.files)
+        # Keep adding files until the project has its target size
+        adds = 1 if len(live) < files and (not live or rng.random() < 0.5) else 0
+        if i == 0:
+            adds = max(1, files // 4)
+        for _ in range(adds):
+            path = project.new_path()
+            project.files[path] = [project.new_line() for _ in range(rng.randint(5, 30))]
+            touched.append(path)
+
+        deleted = []
+        if live and rng.random() < rename_ratio:
+            old_path = rng.choice(live)
+            new_path = project.new_path()
+            project.files[new_path] = project.files.pop(old_path)
+            deleted.append(old_path)
+            live.remove(old_path)
+            touched.append(new_path)
+        if len(live) > 1 and rng.random() < delete_ratio:
+            path = rng.choice(live)
+            del project.files[path]
+            deleted.append(path)
+            live.remove(path)
+        operations.extend(b'D ' + path.encode() + b'\n' for path in deleted)
+
+        for path in rng.sample(live, min(len(live), rng.randint(1, 4))) if live else []:
+            body = project.files[path]
+            for _ in range(rng.randint(0, min(3, len(body)))):
+                body.pop(rng.randrange(len(body)))
+            for _ in range(rng.randint(1, 6)):
+                body.insert(rng.randint(0, len(body)), project.new_line())
+            touched.append(path)
+
+        for path in touched:
+            operations.append(b'M 100644 inline ' + path.encode() + b'\n' + _data(project.content(path)))
+
+        if on_side:
+            branch, parent = b'refs/heads/side', side['tip'] or side['fork']
+            side['tip'] = i + 1
+            side['touched'].update(touched)
+            side['deleted'].update(deleted)
+        else:
+            branch, parent = b'refs/heads/master', master
+            master = i + 1
+        message = f"Change {i + 1} by {name}\n".encode('utf-8')
+        yield (b'commit ' + branch + b'\n' + mark
+               + b'author ' + identity + b'\n'
+               + b'committer ' + identity + b'\n'
+               + _data(message)
+               + (b'from :' + str(parent).encode() + b'\n' if parent else b'')
+               + b''.join(operations)
+               + b'\n')
+
+
+def commit_entry(commit):
+    # Same entry as csc-refactdrill.build_commit_entry, from a git_log_parser record
+    entry = {
+        'commit_hash': commit.hash,
+        'previous_commit_hash': commit.parents[0] if commit.parents else None,
+        'commit_message': commit.msg,
+        'added_lines': 0,
+        'deleted_lines': 0,
+        'diff': {}
+    }
+    stats = []
+    for m in commit.modified_files:
+        path = m.new_path if m.new_path is not None else m.old_path
+        entry['diff'][path] = {
+            'diff': m.diff,
+            'added_lines': m.added_lines,
+            'deleted_lines': m.deleted_lines
+        }
+        entry['added_lines'] += m.added_lines
+        entry['deleted_lines'] += m.deleted_lines
+        stats.append("{:<8}".format(str(m.added_lines)) + "{:<8}".format(str(m.deleted_lines)) + path)
+    entry['diff_stats'] = '\n'.join(stats)
+    return entry
+
+
+def _refactorings(rng, commit):
+    refactorings = []
+    paths = [m.new_path for m in commit.modified_files if m.new_path]
+    for _ in range(rng.randint(1, 3)):
+        path = rng.choice(paths)
+        kind = rng.choice(REFACTORING_TYPES)
+        location = {"filePath": path, "startLine": 4, "endLine": 4 + rng.randint(0, 10),
+                    "startColumn": 5, "endColumn": 40, "codeElementType": "METHOD_DECLARATION"}
+        refactorings.append({"type": kind, "description": f"{kind} in class {os.path.basename(path)[:-5]}",
+                             "leftSideLocations": [location], "rightSideLocations": [location]})
+    return refactorings
+
+
+def generate_project(dest, name='synthetic', commits=200, files=40, authors=5, packages=4,
+                     package_depth=2, rename_ratio=0.05, delete_ratio=0.01, refactoring_ratio=0.2,
+                     commits_format='json', seed=0, merge_ratio=0.0):
+    """
+    Generate a synthetic project (git repository and pipeline outputs)
+    Input: dest: str, folder holding the generated projects
+           name: str, name of the project
+           commits, files, authors, packages: int, size of the history
+           package_depth: int, number of directories below com/example of each package
+           rename_ratio, delete_ratio: float, share of the commits moving or deleting a file
+           refactoring_ratio: float, share of the commits listed with refactorings
+           merge_ratio: float, chance for a commit to fork a side branch, which is merged back
+                        into master a few commits later (0 gives a linear history)
+           commits_format: str, format of the collected commits (see commits_store)
+           seed: int
+    Output: dict describing the project (paths and actual sizes)
+    """
+    rng = random.Random(seed)
+    repo_path = os.path.join(dest, 'repos', name)
+    project_path = os.path.join(dest, name)
+    for path in (repo_path, project_path):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    os.makedirs(project_path)
+
+    subprocess.run(["git", "init", "-q", repo_path], check=True)
+    process = subprocess.Popen(["git", "-C", repo_path, "fast-import", "--quiet"], stdin=subprocess.PIPE)
+    for chunk in _history(rng, commits, files, authors, packages, package_depth, rename_ratio, delete_ratio, merge_ratio):
+        process.stdin.write(chunk)
+    process.stdin.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"git fast-import failed for {repo_path}")
+    subprocess.run(["git", "-C", repo_path, "symbolic-ref", "HEAD", "refs/heads/master"], check=True)
+    subprocess.run(["git", "-C", repo_path, "reset", "-q", "--hard"], check=True)
+
+    # RefactoringMiner lists the newest commits first
+    history = list(iter_log(repo_path, reverse=False))
+    refactoring_hashes = set()
+    with open(os.path.join(project_path, 'refactorings.json'), 'w') as file:
+        writer = JsonArrayWriter(file, 'commits')
+        for commit in history:
+            refactorings = []
+            if commit.parents and any(m.new_path for m in commit.modified_files) and rng.random() < refactoring_ratio:
+                refactorings = _refactorings(rng, commit)
+                refactoring_hashes.add(commit.hash)
+            writer.write({"repository": repo_path, "sha1": commit.hash,
+                          "url": f"https://github.com/example/{name}/commit/{commit.hash}",
+                          "refactorings": refactorings})
+        writer.close()
+    filter_refactorings(os.path.join(project_path, 'refactorings.json'),
+                        os.path.join(project_path, 'only_refactorings.json'))
+
+    writer = commits_store.open_writer(project_path, commits_format)
+    for commit in iter_log(repo_path, patch=True, reverse=False):
+        if commit.hash in refactoring_hashes:
+            writer.write(commit_entry(commit))
+    writer.close()
+
+    info = {
+        'name': name,
+        'repo_path': repo_path,
+        'project_path': project_path,
+        'commits': len(history),
+        'files': files,
+        'authors': authors,
+        'packages': packages,
+        'refactoring_commits': len(refactoring_hashes),
+        'seed': seed,
+        'merge_ratio': merge_ratio,
+    }
+    with open(os.path.join(project_path, 'synthetic.json'), 'w') as file:
+        json.dump(info, file, indent=2)
+    return info
+
+
+if __name__ == "__main__":
+    # python synthetic_repo.py <dest> [commits] [seed]
+    dest = sys.argv[1] if len(sys.argv) > 1 else 'synthetic_projects'
+    commits = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    print(json.dumps(generate_project(dest, commits=commits, files=max(10, commits // 5), seed=seed), indent=2))
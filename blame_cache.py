@@ -0,0 +1,133 @@
+# Blame service shared by the OWN (metrics-comm-own.py) and MINOR (calc_1b_metrics.py) metrics.
+# git blame is run with --incremental, whose machine-readable groups give the author of
+# every range of lines, and the number of lines of each author is cached by the blob of
+# the file and its path. A file that did not change between two refactoring commits has
+# the same blob, so it is never blamed twice. The cache can be kept in a SQLite file to
+# be reused by the other script and by later runs.
+
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+from collections import Counter
+
+SCHEMA = "CREATE TABLE IF NOT EXISTS blames (blob TEXT NOT NULL, path TEXT NOT NULL, authors TEXT NOT NULL, PRIMARY KEY (blob, path))"
+CACHE_FILE = 'blame_cache.sqlite'
+
+
+def parse_incremental(output):
+    """
+    Count the lines of every author in the output of git blame --incremental
+    Input: output: str
+    Output: Counter {author name: number of lines}
+    """
+    authors = {}
+    lines = Counter()
+    commit = None
+    count = 0
+    for line in output.split('\n'):
+        fields = line.split(' ')
+        if len(fields) == 4 and len(fields[0]) == 40 and fields[3].isdigit():
+            # "<commit> <original line> <final line> <number of lines>" starts a group
+            commit = fields[0]
+            count = int(fields[3])
+        elif line.startswith('author ') and commit is not None:
+            # The details of a commit are only given in its first group
+            authors[commit] = line[len('author '):]
+        elif line.startswith('filename ') and commit is not None:
+            # "filename" ends the group
+            lines[authors.get(commit, '')] += count
+            commit = None
+    return lines
+
+
+class BlameCache:
+    """Author line counts of the files of a repository, cached by (blob, path)."""
+
+    def __init__(self, repo_path, cache_file=None):
+        """
+        Input: repo_path: str, path of the git repository
+               cache_file: str or None, SQLite file keeping the blames between runs
+        """
+        self.repo_path = repo_path
+        self.memory = {}
+        self.lock = threading.Lock()
+        self.connection = None
+        if cache_file:
+            self.connection = sqlite3.connect(cache_file, check_same_thread=False)
+            self.connection.execute(SCHEMA)
+        self.batch = None
+        self.blames = 0
+        self.hits = 0
+
+    def blob(self, commit, path):
+        # Blob of a file at a commit, from a single long-running git cat-file
+        with self.lock:
+            if self.batch is None:
+                self.batch = subprocess.Popen(["git", "-C", self.repo_path, "cat-file", "--batch-check"],
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            self.batch.stdin.write(f"{commit}:{path}\n".encode('utf-8', 'surrogateescape'))
+            self.batch.stdin.flush()
+            fields = self.batch.stdout.readline().split()
+        if len(fields) == 3 and fields[1] == b'blob':
+            return fields[0].decode('ascii')
+        return None
+
+    def _load(self, key):
+        if key in self.memory:
+            return self.memory[key]
+        if self.connection is not None:
+            with self.lock:
+                row = self.connection.execute("SELECT authors FROM blames WHERE blob = ? AND path = ?", key).fetchone()
+            if row:
+                lines = Counter(json.loads(row[0]))
+                self.memory[key] = lines
+                return lines
+        return None
+
+    def _store(self, key, lines):
+        self.memory[key] = lines
+        if self.connection is not None:
+            with self.lock:
+                self.connection.execute("INSERT OR REPLACE INTO blames (blob, path, authors) VALUES (?, ?, ?)",
+                                        key + (json.dumps(lines),))
+                self.connection.commit()
+
+    def author_lines(self, commit, path, blob=None):
+        """
+        Number of lines of every author in a file at a commit
+        Input: commit: str, hash of the commit
+               path: str, path of the file in the repository
+               blob: str or None, blob of the file at the commit when already known
+        Output: Counter {author name: number of lines}, empty when the file does not exist at the commit
+        """
+        blob = blob or self.blob(commit, path)
+        if blob is None:
+            return Counter()
+        key = (blob, path)
+        lines = self._load(key)
+        if lines is not None:
+            self.hits += 1
+            return lines
+
+        self.blames += 1
+        result = subprocess.run(["git", "-C", self.repo_path, "blame", "--incremental", commit, "--", path],
+                                capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        lines = parse_incremental(result.stdout)
+        if result.returncode == 0:
+            self._store(key, lines)
+        return lines
+
+    def close(self):
+        if self.batch is not None:
+            self.batch.stdin.close()
+            self.batch.wait()
+            self.batch = None
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def cache_file(folder):
+    return os.path.join(folder, CACHE_FILE)
@@ -0,0 +1,71 @@
+# Line counts of file contents, read by blob from a single long-running git cat-file --batch.
+# LT (lines of a file before the change) only needs the number of lines of the blob the
+# file had before the commit, which git log --raw already gives. Counting the newlines of
+# the blob as it is streamed avoids decoding the whole pre-image of every modified file
+# (pydriller's source_code_before) only to split it, and a blob is read once per run.
+
+import subprocess
+import threading
+
+READ_SIZE = 1 << 20
+
+
+class BlobLines:
+    """Number of lines of the blobs of a repository, cached by blob."""
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.counts = {}
+        self.process = None
+
+    def _start(self):
+        if self.process is None:
+            self.process = subprocess.Popen(["git", "-C", self.repo_path, "cat-file", "--batch"],
+                                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return self.process
+
+    def _request(self, blobs):
+        for blob in blobs:
+            self.process.stdin.write(f"{blob}\n".encode('ascii'))
+        self.process.stdin.flush()
+
+    def _read_answer(self):
+        # "<blob> blob <size>" then the content and a newline, or "<blob> missing"
+        fields = self.process.stdout.readline().split()
+        if len(fields) != 3:
+            return 0
+        size = int(fields[2])
+        newlines = 0
+        remaining = size
+        while remaining:
+            chunk = self.process.stdout.read(min(remaining, READ_SIZE))
+            if not chunk:
+                break
+            newlines += chunk.count(b'\n')
+            remaining -= len(chunk)
+        self.process.stdout.read(1)
+        # Same count as len(source_code_before.split('\n')), 0 for an empty file
+        return newlines + 1 if size else 0
+
+    def line_counts(self, blobs):
+        """
+        Number of lines of a batch of blobs
+        Input: blobs: list of str or None (None for a file that did not exist, e.g. an added file)
+        Output: list of int, in the same order
+        """
+        missing = [blob for blob in dict.fromkeys(blobs) if blob and blob not in self.counts]
+        if missing:
+            self._start()
+            # The requests are written by a thread while the answers are read, so neither pipe fills up
+            writer = threading.Thread(target=self._request, args=(missing,))
+            writer.start()
+            for blob in missing:
+                self.counts[blob] = self._read_answer()
+            writer.join()
+        return [self.counts.get(blob, 0) if blob else 0 for blob in blobs]
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
@@ -0,0 +1,159 @@
+# Checkpoints of the long metric traversals (calc_1b_metrics.py, calc_2_metrics.py and
+# fused_metrics.py). Every CHECKPOINT_INTERVAL seconds the state of the traversal and the
+# results computed so far are pickled next to the refactorings file, with the position and
+# hash of the last processed commit. When the job is stopped (time limit, node failure),
+# the next run restores that state and fast-forwards the history to the following commit
+# instead of starting again from the first one. The checkpoint is removed once the run is done.
+#
+# In incremental mode (INCREMENTAL=1) the final state of a run is kept too, with the HEAD it
+# covers. When the repository gained commits since, the next run restores that state and
+# only reads the commits between that HEAD and the new one, so its cost follows the new
+# history, and the metrics of the new commits are appended to the earlier ones.
+
+import os
+import pickle
+import subprocess
+import time
+
+# Seconds between two checkpoints, 0 disables them
+CHECKPOINT_INTERVAL = int(os.environ.get('CHECKPOINT_INTERVAL', 900))
+CHECKPOINT_VERSION = 1
+# Keep the final state of every run and only process the new commits on the next one
+INCREMENTAL = os.environ.get('INCREMENTAL', '0') == '1'
+
+
+def checkpoint_path(folder, name):
+    return os.path.join(folder, f"{name}.checkpoint.pkl")
+
+
+def final_state_path(checkpoint_file):
+    # The final state of an incremental run sits next to its checkpoint
+    return checkpoint_file.replace('.checkpoint.pkl', '.state.pkl')
+
+
+class Checkpointer:
+    """Saves and restores the state of a traversal of the history of a repository."""
+
+    def __init__(self, path, interval=None, incremental=None):
+        """
+        Input: path: str, pickle file of the checkpoint
+               interval: int or None, seconds between two checkpoints (CHECKPOINT_INTERVAL by default)
+               incremental: bool or None, keep the final state (INCREMENTAL by default)
+        """
+        self.path = path
+        self.interval = CHECKPOINT_INTERVAL if interval is None else interval
+        self.incremental = INCREMENTAL if incremental is None else incremental
+        self.position = -1
+        self.commit_hash = None
+        # HEAD of the history covered by the restored final state, the run goes on from there,
+        # and the number of commits it covers, so the positions stay those of the whole history
+        self.base = None
+        self.offset = 0
+        # Last processed commit
+        self.last = None
+        self.last_save = time.monotonic()
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as file:
+                checkpoint = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError) as e:
+            print(f"Ignoring the checkpoint {path}: {e}")
+            return None
+        if checkpoint.get('version') != CHECKPOINT_VERSION:
+            return None
+        return checkpoint
+
+    def load(self):
+        """
+        Read the checkpoint left by an earlier run, or in incremental mode the final state of the last complete run
+        Output: the saved state, or None when there is no usable checkpoint
+        """
+        checkpoint = self._read(self.path)
+        if checkpoint is not None:
+            self.position = checkpoint['position']
+            self.commit_hash = checkpoint['commit']
+            self.base = checkpoint.get('base')
+            self.offset = checkpoint.get('offset', 0)
+            print(f"Resuming after commit {self.position + 1} ({self.commit_hash})")
+            return checkpoint['state']
+        if self.incremental:
+            final = self._read(final_state_path(self.path))
+            if final is not None:
+                self.base = final['commit']
+                self.offset = final['position'] + 1
+                print(f"Analysing the commits after {self.base}")
+                return final['state']
+        return None
+
+    def revisions(self, repo_path):
+        """
+        Revisions to give to git log: only the commits after the restored final state
+        Input: repo_path: str
+        Output: str
+        Raises ValueError when HEAD does not descend from the analysed history anymore (e.g. after a force push)
+        """
+        if not self.base:
+            return 'HEAD'
+        result = subprocess.run(["git", "-C", repo_path, "merge-base", "--is-ancestor", self.base, "HEAD"], capture_output=True)
+        if result.returncode != 0:
+            raise ValueError(f"{self.base} is no longer in the history of {repo_path}, "
+                             f"remove {final_state_path(self.path)} to analyse it from scratch")
+        return f"{self.base}..HEAD"
+
+    def skip(self, commits):
+        """
+        Fast-forward a stream of commits past the checkpointed commit
+        Input: commits: iterable of commits, in the order of the checkpointed run
+        Output: generator of (position, commit) of the commits still to process
+        Raises ValueError when the history does not match the checkpoint
+        """
+        for position, commit in enumerate(commits, start=self.offset):
+            if position < self.position:
+                continue
+            if position == self.position:
+                if commit.hash != self.commit_hash:
+                    raise ValueError(f"commit {position + 1} is {commit.hash}, the checkpoint was taken at {self.commit_hash}")
+                continue
+            yield position, commit
+
+    def step(self, position, commit_hash, get_state):
+        # Called after every processed commit, get_state is only called when a checkpoint is due
+        self.last = (position, commit_hash)
+        if not self.interval or time.monotonic() - self.last_save < self.interval:
+            return
+        self.save(position, commit_hash, get_state())
+
+    def save(self, position, commit_hash, state):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump({'version': CHECKPOINT_VERSION, 'position': position, 'commit': commit_hash,
+                         'base': self.base, 'offset': self.offset, 'state': state},
+                        file, protocol=pickle.HIGHEST_PROTOCOL)
+        # A job killed while writing leaves the previous checkpoint in place
+        os.replace(tmp_path, self.path)
+        self.position = position
+        self.commit_hash = commit_hash
+        self.last_save = time.monotonic()
+
+    def finish(self, get_state):
+        """
+        End of a complete run: keep its final state in incremental mode, and remove the checkpoint
+        Input: get_state: function returning the state of the traversal
+        """
+        # Without new commits the earlier final state still holds
+        if self.incremental and self.last is not None:
+            position, head = self.last
+            final = final_state_path(self.path)
+            with open(final + '.tmp', 'wb') as file:
+                pickle.dump({'version': CHECKPOINT_VERSION, 'position': position, 'commit': head, 'state': get_state()},
+                            file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(final + '.tmp', final)
+        self.remove()
+
+    def remove(self):
+        for path in (self.path, self.path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
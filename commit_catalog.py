@@ -0,0 +1,291 @@
+# Per-repository SQLite catalog of the commit history, shared by the pipeline stages.
+# It is built once after mining, next to refactorings.json, from a single git log and the
+# refactorings file. It holds the commits with their parents, authors, dates, touched
+# paths and refactoring types, indexed by hash and by topological position (parents
+# before children). The scripts query it instead of walking the history or reloading the
+# big JSON files again, and it stays usable after the clone of the repository is removed.
+# When the repository gained commits on top of the catalogued HEAD, only the new ones are
+# read and appended.
+
+import os
+import sqlite3
+import subprocess
+import threading
+from collections import Counter
+from datetime import datetime
+
+from git_log_parser import iter_log
+from refactorings_reader import iter_refactoring_commits
+
+CATALOG_FILE = 'catalog.sqlite'
+SCHEMA_VERSION = '1'
+BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS commits (
+    position INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    author_name TEXT, author_email TEXT, author_date TEXT,
+    committer_name TEXT, committer_email TEXT, committer_date TEXT,
+    msg TEXT,
+    is_refactoring INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS parents (position INTEGER NOT NULL, number INTEGER NOT NULL, parent_hash TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    position INTEGER NOT NULL,
+    old_path TEXT, new_path TEXT, change_type TEXT,
+    added_lines INTEGER, deleted_lines INTEGER
+);
+CREATE TABLE IF NOT EXISTS refactorings (position INTEGER NOT NULL, type TEXT NOT NULL, count INTEGER NOT NULL);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS parents_position ON parents (position);
+CREATE INDEX IF NOT EXISTS parents_hash ON parents (parent_hash);
+CREATE INDEX IF NOT EXISTS files_position ON files (position);
+CREATE INDEX IF NOT EXISTS files_new_path ON files (new_path);
+CREATE INDEX IF NOT EXISTS files_old_path ON files (old_path);
+CREATE INDEX IF NOT EXISTS refactorings_position ON refactorings (position);
+CREATE INDEX IF NOT EXISTS commits_refactoring ON commits (is_refactoring);
+"""
+
+
+def catalog_path(folder):
+    return os.path.join(folder, CATALOG_FILE)
+
+
+def _head(repo_path):
+    result = subprocess.run(["git", "-C", repo_path, "rev-parse", "HEAD"], capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def _file_stamp(file_path):
+    # Identifies a version of the refactorings file without reading it
+    if not file_path or not os.path.exists(file_path):
+        return ''
+    stat = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _set_meta(connection, key, value):
+    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def build_catalog(repo_path, path, refactorings_file=None):
+    """
+    Build the catalog of a repository from scratch
+    Input: repo_path: str, path of the git repository
+           path: str, path of the SQLite file to create
+           refactorings_file: str or None, refactorings.json (or only_refactorings.json) of the repository
+    Output: CommitCatalog
+    """
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.executescript(SCHEMA)
+        _load_history(connection, repo_path, 'HEAD', 0)
+        connection.executescript(INDEXES)
+        _set_meta(connection, 'schema_version', SCHEMA_VERSION)
+        _set_meta(connection, 'head', _head(repo_path) or '')
+        _mark_refactorings(connection, refactorings_file)
+        connection.commit()
+    finally:
+        connection.close()
+    # Readers never see a half-built catalog
+    os.replace(tmp_path, path)
+    return CommitCatalog(path)
+
+
+def _load_history(connection, repo_path, rev, first_position):
+    # Insert the commits of git log <rev>, numbered from first_position
+    commits, parents, files = [], [], []
+    for position, commit in enumerate(iter_log(repo_path, rev=rev, extra_args=['--topo-order']), first_position):
+        commits.append((position, commit.hash, commit.author.name, commit.author.email,
+                        commit.author_date.isoformat(), commit.committer.name, commit.committer.email,
+                        commit.committer_date.isoformat(), commit.msg))
+        parents.extend((position, number, parent) for number, parent in enumerate(commit.parents))
+        files.extend((position, mod.old_path, mod.new_path, mod.change_type.name, mod.added_lines, mod.deleted_lines)
+                     for mod in commit.modified_files)
+        if len(files) >= BATCH_SIZE or len(commits) >= BATCH_SIZE:
+            _insert(connection, commits, parents, files)
+            commits, parents, files = [], [], []
+    _insert(connection, commits, parents, files)
+
+
+def _is_ancestor(repo_path, ancestor, head):
+    result = subprocess.run(["git", "-C", repo_path, "merge-base", "--is-ancestor", ancestor, head], capture_output=True)
+    return result.returncode == 0
+
+
+def append_commits(catalog, repo_path, head, refactorings_file=None):
+    """
+    Add the commits made on top of the catalogued HEAD
+    Input: catalog: CommitCatalog, whose HEAD is an ancestor of head
+           repo_path: str
+           head: str, new HEAD of the repository
+           refactorings_file: str or None
+    """
+    with catalog.lock:
+        connection = catalog.connection
+        old_head = connection.execute("SELECT value FROM meta WHERE key = 'head'").fetchone()[0]
+        count = connection.execute("SELECT COUNT(*) FROM commits").fetchone()[0]
+        # The new commits come after all the catalogued ones, so the positions stay topological
+        _load_history(connection, repo_path, f"{old_head}..{head}", count)
+        _set_meta(connection, 'head', head)
+        _mark_refactorings(connection, refactorings_file)
+        connection.commit()
+
+
+def _insert(connection, commits, parents, files):
+    connection.executemany("INSERT INTO commits (position, hash, author_name, author_email, author_date, "
+                           "committer_name, committer_email, committer_date, msg) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           commits)
+    connection.executemany("INSERT INTO parents (position, number, parent_hash) VALUES (?, ?, ?)", parents)
+    connection.executemany("INSERT INTO files (position, old_path, new_path, change_type, added_lines, deleted_lines) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", files)
+
+
+def _mark_refactorings(connection, refactorings_file):
+    connection.execute("UPDATE commits SET is_refactoring = 0")
+    connection.execute("DELETE FROM refactorings")
+    if refactorings_file and os.path.exists(refactorings_file):
+        positions = dict(connection.execute("SELECT hash, position FROM commits"))
+        rows = []
+        flags = []
+        for commit in iter_refactoring_commits(refactorings_file):
+            position = positions.get(commit['sha1'])
+            if position is None:
+                continue
+            flags.append((position,))
+            types = Counter(refactoring['type'] for refactoring in commit['refactorings'])
+            rows.extend((position, kind, count) for kind, count in types.items())
+        connection.executemany("UPDATE commits SET is_refactoring = 1 WHERE position = ?", flags)
+        connection.executemany("INSERT INTO refactorings (position, type, count) VALUES (?, ?, ?)", rows)
+    _set_meta(connection, 'refactorings', _file_stamp(refactorings_file))
+
+
+def open_catalog(repo_path, path, refactorings_file=None):
+    """
+    Open the catalog of a repository, building it when it is missing or out of date
+    Input: repo_path: str, path of the git repository (may already be removed)
+           path: str, path of the SQLite file
+           refactorings_file: str or None, refactorings.json (or only_refactorings.json)
+    Output: CommitCatalog
+    """
+    if os.path.exists(path):
+        catalog = CommitCatalog(path)
+        head = _head(repo_path) if os.path.exists(repo_path) else None
+        # The clone may be gone already, the catalog is then used as it is
+        if catalog.meta('schema_version') == SCHEMA_VERSION and (head is None or head == catalog.meta('head')):
+            if refactorings_file and catalog.meta('refactorings') != _file_stamp(refactorings_file):
+                catalog.update_refactorings(refactorings_file)
+            return catalog
+        if catalog.meta('schema_version') == SCHEMA_VERSION and catalog.meta('head') and _is_ancestor(repo_path, catalog.meta('head'), head):
+            # The repository moved on since the catalog was built, only the new commits are read
+            append_commits(catalog, repo_path, head, refactorings_file)
+            return catalog
+        catalog.close()
+    return build_catalog(repo_path, path, refactorings_file)
+
+
+class CommitCatalog:
+    """Read access to a catalog built by build_catalog."""
+
+    def __init__(self, path):
+        self.path = path
+        # Shared by the threads of a stage, sqlite3 serializes the calls
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def _query(self, sql, args=()):
+        with self.lock:
+            return self.connection.execute(sql, args).fetchall()
+
+    def meta(self, key):
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def update_refactorings(self, refactorings_file):
+        # Only the refactoring flags change when RefactoringMiner is run again on the same history
+        with self.lock:
+            _mark_refactorings(self.connection, refactorings_file)
+            self.connection.commit()
+
+    def count(self):
+        return self._query("SELECT COUNT(*) FROM commits")[0][0]
+
+    def position(self, commit_hash):
+        rows = self._query("SELECT position FROM commits WHERE hash = ?", (commit_hash,))
+        return rows[0][0] if rows else None
+
+    def positions(self):
+        """{hash: position} of every commit."""
+        return dict(self._query("SELECT hash, position FROM commits"))
+
+    def commit_hash(self, position):
+        rows = self._query("SELECT hash FROM commits WHERE position = ?", (position,))
+        return rows[0][0] if rows else None
+
+    def parents(self, commit_hash):
+        return [row[0] for row in self._query(
+            "SELECT parent_hash FROM parents JOIN commits USING (position) WHERE hash = ? ORDER BY number",
+            (commit_hash,))]
+
+    def committer_dates(self):
+        """{hash: committer date} of every commit, like get_commit_dates in calc_2_metrics.py."""
+        return {commit_hash: datetime.fromisoformat(date)
+                for commit_hash, date in self._query("SELECT hash, committer_date FROM commits")}
+
+    def authors(self):
+        """Author name of every commit, in topological order."""
+        return [row[0] for row in self._query("SELECT author_name FROM commits ORDER BY position")]
+
+    def is_refactoring(self, commit_hash):
+        rows = self._query("SELECT is_refactoring FROM commits WHERE hash = ?", (commit_hash,))
+        return bool(rows and rows[0][0])
+
+    def refactoring_hashes(self):
+        return {row[0] for row in self._query("SELECT hash FROM commits WHERE is_refactoring = 1")}
+
+    def refactoring_counts(self):
+        """{commit hash: {refactoring type: count}} of the refactoring commits."""
+        counts = {}
+        for commit_hash, kind, count in self._query("SELECT hash, type, count FROM refactorings JOIN commits USING (position)"):
+            counts.setdefault(commit_hash, {})[kind] = count
+        return counts
+
+    def refactoring_types(self, commit_hash):
+        """{refactoring type: count} of a commit."""
+        return dict(self._query("SELECT type, count FROM refactorings JOIN commits USING (position) WHERE hash = ?",
+                                (commit_hash,)))
+
+    def files(self, commit_hash):
+        """(old path, new path, change type, added lines, deleted lines) of the files touched by a commit."""
+        return self._query("SELECT old_path, new_path, change_type, added_lines, deleted_lines FROM files "
+                           "JOIN commits USING (position) WHERE hash = ?", (commit_hash,))
+
+    def file_changes(self):
+        """
+        Every file change of the history, in topological order
+        Output: list of (position, hash, author email, old path, new path, change type, added lines, deleted lines)
+        """
+        return self._query("SELECT position, hash, author_email, old_path, new_path, change_type, added_lines, deleted_lines "
+                           "FROM files JOIN commits USING (position) ORDER BY position, files.rowid")
+
+    def refactoring_commits(self):
+        """(position, hash, message) of the refactoring commits, in topological order."""
+        return self._query("SELECT position, hash, msg FROM commits WHERE is_refactoring = 1 ORDER BY position")
+
+    def refactoring_file_changes(self):
+        """
+        File changes of the refactoring commits, in topological order
+        Output: list of (position, old path, new path, added lines, deleted lines)
+        """
+        return self._query("SELECT position, old_path, new_path, added_lines, deleted_lines FROM files "
+                           "JOIN commits USING (position) WHERE is_refactoring = 1 ORDER BY position, files.rowid")
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,209 @@
+# Storage of the commits.json data collected by csc-refactdrill.py.
+# Two formats are supported:
+#  - "json": the original commits.json, a JSON array indented by 2
+#  - "jsonl.gz": commits.jsonl.gz, one gzip-compressed JSON line per commit, where the
+#    diff text of every file is replaced by a "diff_ref" content hash. Each distinct
+#    diff body is stored once, zlib-compressed, in commits.diffs.pack, and
+#    commits.diffs.idx.json maps every hash to its offset and length in the pack.
+# The readers below serve both formats, so scripts do not need to know which one a
+# project was collected with. Both writers can also append the commits of a later
+# collection (the new commits of a repository) to the existing files.
+
+import gzip
+import hashlib
+import json
+import os
+import textwrap
+import zlib
+
+from refactorings_reader import iter_array
+
+COMMITS_JSON = 'commits.json'
+COMMITS_JSONL = 'commits.jsonl.gz'
+DIFFS_PACK = 'commits.diffs.pack'
+DIFFS_INDEX = 'commits.diffs.idx.json'
+
+FORMATS = ('json', 'jsonl.gz')
+
+
+def diff_hash(diff):
+    return hashlib.sha1(diff.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class JsonCommitsWriter:
+    """Write commits.json one entry at a time, with the layout of json.dump(commits, file, indent=2)."""
+
+    def __init__(self, folder, append=False):
+        self.path = os.path.join(folder, COMMITS_JSON)
+        # End of the earlier entries when appending, abort() cuts the file back there
+        self.start = None
+        if append and os.path.exists(self.path):
+            self.start, self.count = self._reopen()
+            self.earlier = self.count
+            self.file = open(self.path, 'a')
+        else:
+            self.file = open(self.path, 'w')
+            self.file.write('[')
+            self.count = 0
+
+    def _reopen(self):
+        # Drop the closing bracket of the array, the new entries go after the existing ones
+        with open(self.path, 'rb+') as file:
+            size = file.seek(0, os.SEEK_END)
+            file.seek(max(0, size - 64))
+            tail = file.read()
+            # The bracket goes with the newline before it, as close() writes them
+            end = size - len(tail) + len(tail[:tail.rindex(b']')].rstrip())
+            file.truncate(end)
+            file.seek(0)
+            # The array is empty when nothing but '[' and whitespace comes before the bracket
+            empty = file.read(64).strip() == b'['
+        return end, 0 if empty else 1
+
+    def write(self, entry):
+        self.file.write(',\n' if self.count else '\n')
+        self.file.write(textwrap.indent(json.dumps(entry, indent=2), '  '))
+        self.count += 1
+
+    def close(self):
+        self.file.write('\n]' if self.count else ']')
+        self.file.close()
+
+    def abort(self):
+        # Do not leave a truncated file behind
+        self.file.close()
+        if self.start is None:
+            os.remove(self.path)
+            return
+        # An aborted append leaves the earlier entries as they were
+        with open(self.path, 'rb+') as file:
+            file.truncate(self.start)
+            file.seek(self.start)
+            file.write(b'\n]' if self.earlier else b']')
+
+
+class PackedCommitsWriter:
+    """Write commits.jsonl.gz with every distinct diff body stored once in the diff pack."""
+
+    def __init__(self, folder, append=False):
+        self.paths = [os.path.join(folder, name) for name in (COMMITS_JSONL, DIFFS_PACK, DIFFS_INDEX)]
+        # Sizes of the commits file and the pack before this writer, kept by abort() when appending
+        self.sizes = None
+        self.index = {}
+        if append and all(os.path.exists(path) for path in self.paths):
+            self.sizes = [os.path.getsize(path) for path in self.paths[:2]]
+            # The diffs already in the pack are not stored again
+            with open(self.paths[2], 'r') as file:
+                self.index = json.load(file)
+        # Appending adds a gzip member, which gzip readers go through as one stream
+        self.file = gzip.open(self.paths[0], 'at' if self.sizes else 'wt', encoding='utf-8')
+        self.pack = open(self.paths[1], 'ab' if self.sizes else 'wb')
+        self.count = 0
+
+    def _store_diff(self, diff):
+        key = diff_hash(diff)
+        if key not in self.index:
+            data = zlib.compress(diff.encode('utf-8', 'surrogatepass'))
+            self.index[key] = [self.pack.tell(), len(data)]
+            self.pack.write(data)
+        return key
+
+    def write(self, entry):
+        record = dict(entry)
+        record['diff'] = {}
+        for path, file_diff in entry['diff'].items():
+            file_record = {key: value for key, value in file_diff.items() if key != 'diff'}
+            file_record['diff_ref'] = self._store_diff(file_diff.get('diff') or '')
+            record['diff'][path] = file_record
+        self.file.write(json.dumps(record) + '\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+        self.pack.close()
+        with open(self.paths[2], 'w') as file:
+            json.dump(self.index, file)
+
+    def abort(self):
+        self.file.close()
+        self.pack.close()
+        if self.sizes:
+            # The index is only written by close(), so it still matches the truncated pack
+            for path, size in zip(self.paths, self.sizes):
+                os.truncate(path, size)
+            return
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def open_writer(folder, fmt='json', append=False):
+    """
+    Open a writer for the commits of a project folder
+    Input: folder: str
+           fmt: 'json' (commits.json) or 'jsonl.gz' (commits.jsonl.gz + diff pack)
+           append: bool, add the entries after those of an existing file of the same format
+    Output: writer with write(entry), close() and abort()
+    """
+    if fmt == 'json':
+        return JsonCommitsWriter(folder, append)
+    if fmt == 'jsonl.gz':
+        return PackedCommitsWriter(folder, append)
+    raise ValueError(f"Unknown commits format: {fmt} (expected one of {FORMATS})")
+
+
+class DiffPack:
+    """Random access to the diff bodies of a commits.diffs.pack file."""
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, DIFFS_INDEX), 'r') as file:
+            self.index = json.load(file)
+        self.pack = open(os.path.join(folder, DIFFS_PACK), 'rb')
+
+    def get(self, key):
+        offset, length = self.index[key]
+        self.pack.seek(offset)
+        return zlib.decompress(self.pack.read(length)).decode('utf-8', 'surrogatepass')
+
+    def close(self):
+        self.pack.close()
+
+
+def has_commits(folder):
+    return (os.path.exists(os.path.join(folder, COMMITS_JSONL))
+            or os.path.exists(os.path.join(folder, COMMITS_JSON)))
+
+
+def iter_commit_entries(folder, with_diffs=True):
+    """
+    Yield the commit entries of a project folder one at a time, whatever their format
+    Input: folder: str, folder holding commits.jsonl.gz or commits.json
+           with_diffs: bool, load the diff text of every file. When False, the
+                       commits.jsonl.gz format skips reading the diff pack entirely.
+    Output: generator of dict, shaped like the entries of commits.json
+    """
+    packed_path = os.path.join(folder, COMMITS_JSONL)
+    if not os.path.exists(packed_path):
+        for entry in iter_array(os.path.join(folder, COMMITS_JSON)):
+            yield entry
+        return
+
+    pack = DiffPack(folder) if with_diffs else None
+    try:
+        with gzip.open(packed_path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                entry = json.loads(line)
+                for path, file_diff in entry['diff'].items():
+                    key = file_diff.pop('diff_ref')
+                    if pack is not None:
+                        # Same key order as in commits.json
+                        entry['diff'][path] = {'diff': pack.get(key), **file_diff}
+                yield entry
+    finally:
+        if pack is not None:
+            pack.close()
+
+
+def load_commit_entries(folder, with_diffs=True):
+    """Same as iter_commit_entries, as a list."""
+    return list(iter_commit_entries(folder, with_diffs))
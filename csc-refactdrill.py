@@ -1,13 +1,19 @@
 # Imports
 import json
-import shutil
-import stat
 import subprocess   # For executing external commands
 import threading    # For creating and managing threads
+import queue        # For passing repositories between the pipeline stages
 import os           # For interacting with the operating system
-import time         # For time-related functions
+import shutil       # For removing the shards of an earlier run
+from concurrent.futures import ThreadPoolExecutor # For running RefactoringMiner shards in parallel
 
-from pydriller import Repository # For extracting commit information
+from pydriller import Git # For extracting commit information
+
+from refactorings_reader import iter_commits, iter_refactoring_commits, JsonArrayWriter # For streaming refactorings.json
+import repo_cache # Shared cache of repository mirrors
+import commits_store # Writers for commits.json and its compressed variant
+import telemetry # Per-repository stage timing and resource usage
+import commit_catalog # SQLite catalog of the history, queried by the metric scripts
 
 # Path to the RefactoringMiner executable
 miner = os.getenv('REFMINER_PATH')
@@ -15,6 +21,40 @@ miner = os.getenv('REFMINER_PATH')
 git_root = os.getenv('GIT_REPOS_ROOT', '../repos')
 # Max number of threads to run concurrently from $SLURM_CPUS_PER_TASK
 max_threads = int(os.getenv('NUM_THREADS', '1'))
+# Number of repositories cloned ahead of the mining stage
+prefetch_repos = max(1, int(os.getenv('PREFETCH_REPOS', '2')))
+# Number of threads cloning repositories
+num_clone_threads = int(os.getenv('CLONE_THREADS', '1'))
+# Number of threads collecting commits and removing the mined repositories
+num_collect_threads = int(os.getenv('COLLECT_THREADS', '1'))
+# Format of the collected commits: 'json' (commits.json) or 'jsonl.gz' (compressed, diffs stored once)
+commits_format = os.getenv('COMMITS_FORMAT', 'json')
+# Optional JSON file with the estimated number of commits of each repository
+repo_costs_file = os.getenv('REPO_COSTS')
+# Number of first-parent commits per RefactoringMiner shard, 0 mines the whole history at once
+shard_size = int(os.getenv('SHARD_SIZE', '0'))
+# Number of RefactoringMiner shards of one repository run in parallel
+shard_workers = max(1, int(os.getenv('SHARD_WORKERS', '1')))
+# Share of the node memory that RefactoringMiner JVMs may commit
+memory_budget_ratio = float(os.getenv('MEMORY_BUDGET_RATIO', '0.9'))
+# Heap of a RefactoringMiner JVM: a base plus an amount per thousand commits it walks
+heap_base_mb = int(os.getenv('HEAP_BASE_MB', '2048'))
+heap_mb_per_1k_commits = int(os.getenv('HEAP_MB_PER_1K_COMMITS', '100'))
+# Memory used by a JVM on top of its heap (metaspace, threads, GC structures)
+jvm_overhead = 1.25
+# Number of times a repository is requeued with a bigger heap after an OutOfMemoryError
+oom_retries = int(os.getenv('OOM_RETRIES', '3'))
+# Only mine and collect the commits made since the last run of an already mined repository
+incremental = os.getenv('INCREMENTAL', '0') == '1'
+
+# Status of a RefactoringMiner run
+MINER_DONE = 'done'
+MINER_OOM = 'out of memory'
+MINER_FAILED = 'failed'
+
+# Heap and number of attempts of each repository, shared by the mining threads
+miner_heaps = {}
+miner_attempts = {}
 
 def collect_refactoring_commits(link):
     # Extract the folder name from the link (repository name)
@@ -23,71 +63,119 @@ def collect_refactoring_commits(link):
     path = git_root+"/"+folder
     # Define RefactoringMiner output file
     output_file = './' + folder + '/refactorings.json'
+    # An incremental run only collects the commits RefactoringMiner found in the new history
+    new_file = './' + folder + '/refactorings.new.json'
+    append = os.path.exists(new_file)
+    if append:
+        output_file = new_file
+    elif incremental and os.path.exists('./' + folder + '/done') and commits_store.has_commits('./' + folder) \
+            and analysed_head(folder) == repo_head(path):
+        print(f"No new commits to collect for {folder}")
+        return
 
+    if not os.path.exists(output_file):
+        print('Error reading file:', output_file)
+        return
+
+    # Stream the commits with refactoring activity out of the refactoring file,
+    # look each of them up directly by its hash instead of walking the whole
+    # history, and write every entry to the commits file as soon as it is built
+    git_repo = Git(path)
+    # Commits collected by an earlier run, when resuming an interrupted incremental one
+    collected = set()
+    if append and commits_store.has_commits('./' + folder):
+        collected = {entry['commit_hash'] for entry in commits_store.iter_commit_entries('./' + folder, with_diffs=False)}
+    writer = commits_store.open_writer('./' + folder, commits_format, append)
     try:
-        # Load refactoring file
-        with open(output_file, 'r') as file:
+        for refactoring_commit in iter_refactoring_commits(output_file):
+            hash1 = refactoring_commit['sha1']
+            if hash1 in collected:
+                continue
             try:
-                refactorings = json.load(file)
-            except json.JSONDecodeError as e:
-                print(f'Error loading JSON from file: {output_file}')
-                print(f'Error message: {e.msg}')
-                print(f'Error at line {e.lineno}, column {e.colno}')
-                return
-    except FileNotFoundError:
-        print('Error reading file:', output_file)
+                commit = git_repo.get_commit(hash1)
+            except Exception as e:
+                print(f'Commit {hash1} not found in {path}: {e}')
+                continue
+            writer.write(build_commit_entry(commit))
+        writer.close()
+    except json.JSONDecodeError as e:
+        print(f'Error loading JSON from file: {output_file}')
+        print(f'Error message: {e.msg}')
+        print(f'Error at line {e.lineno}, column {e.colno}')
+        # Do not leave a truncated commits file behind
+        writer.abort()
         return
+    except BaseException:
+        # Same for any other failure, or has_commits would take the project as collected
+        writer.abort()
+        raise
+    finally:
+        git_repo.clear()
+    if append:
+        merge_new_refactorings(folder)
+        os.remove(new_file)
 
-    # Get all commits with refactoring activity
-    refactoring_commits = []
-    for commit in refactorings['commits']:
-        if commit['refactorings']:
-            refactoring_commits.append(commit['sha1'])
-
-    # Get all commits from repo
-    all_commits = []
-    for commit in Repository(path).traverse_commits():
-        all_commits.append(commit)
-
-    # Get all commits with refactoring activity
-    commits = []
-    for index, hash1 in enumerate(refactoring_commits):
-        for commit in all_commits:
-            if commit.hash == hash1:
-                communist = {
-                    'commit_hash': commit.hash,
-                    'previous_commit_hash': commit.parents[0] if commit.parents else None,
-                    'commit_message': commit.msg,
-                    'added_lines': 0,
-                    'deleted_lines': 0,
-                    'diff': {}
-                }
-                stats = []
-                for m in commit.modified_files:
-                    path = ""
-                    try:
-                        path = m.new_path.replace('\\', '/')
-                    except:
-                        path = m.old_path.replace('\\', '/')
-
-                    communist['diff'][path] = {
-                        'diff': m.diff,
-                        'added_lines': m.added_lines,
-                        'deleted_lines': m.deleted_lines
-                    }
-                    communist['added_lines'] += m.added_lines
-                    communist['deleted_lines'] += m.deleted_lines
-                    try:
-                        stats.append("{:<8}".format(str(m.added_lines)) + "{:<8}".format(str(m.deleted_lines)) + path)
-                    except:
-                        pass
-
-                communist['diff_stats'] = '\n'.join(stats)
-                commits.append(communist)
-
-    # Write refactoring commits to file
-    with open('./' + folder + '/commits.json', 'w') as file:
-        json.dump(commits, file, indent=2)
+
+def merge_new_refactorings(folder):
+    # Add the commits of refactorings.new.json in front of those of refactorings.json (newest
+    # first, like RefactoringMiner lists them), each commit once
+    output_file = './' + folder + '/refactorings.json'
+    new_file = './' + folder + '/refactorings.new.json'
+    tmp_file = output_file + ".tmp"
+    seen = set()
+    with open(tmp_file, 'w') as file:
+        writer = JsonArrayWriter(file, 'commits')
+        for commit in iter_commits(new_file):
+            seen.add(commit['sha1'])
+            writer.write(commit)
+        for commit in iter_commits(output_file):
+            if commit['sha1'] not in seen:
+                writer.write(commit)
+        writer.close()
+    os.replace(tmp_file, output_file)
+
+
+def build_catalog(link):
+    # Extract the folder name from the link (repository name)
+    folder = link.split('/')[-1].split('.')[0]
+    path = git_root+"/"+folder
+    output_file = './' + folder + '/refactorings.json'
+    catalog = commit_catalog.open_catalog(path, commit_catalog.catalog_path('./' + folder), output_file)
+    catalog.close()
+
+
+def build_commit_entry(commit):
+    # Build the commits.json entry of a single refactoring commit
+    communist = {
+        'commit_hash': commit.hash,
+        'previous_commit_hash': commit.parents[0] if commit.parents else None,
+        'commit_message': commit.msg,
+        'added_lines': 0,
+        'deleted_lines': 0,
+        'diff': {}
+    }
+    stats = []
+    for m in commit.modified_files:
+        path = ""
+        try:
+            path = m.new_path.replace('\\', '/')
+        except:
+            path = m.old_path.replace('\\', '/')
+
+        communist['diff'][path] = {
+            'diff': m.diff,
+            'added_lines': m.added_lines,
+            'deleted_lines': m.deleted_lines
+        }
+        communist['added_lines'] += m.added_lines
+        communist['deleted_lines'] += m.deleted_lines
+        try:
+            stats.append("{:<8}".format(str(m.added_lines)) + "{:<8}".format(str(m.deleted_lines)) + path)
+        except:
+            pass
+
+    communist['diff_stats'] = '\n'.join(stats)
+    return communist
 
 
 def getlinks(file_path):
@@ -111,10 +199,10 @@ def clone_repo(link):
 
     # Check if the repository folder already exists
     if not os.path.exists(path):
-        # Clone the repository if it does not exist
-        subprocess.call(["git", "clone", link, path])
+        # Make a working copy out of the shared repository cache if it does not exist
+        repo_cache.checkout(link, path)
 
-def refactoring_miner(link):
+def refactoring_miner(link, heap_mb=None, workers=None):
     # Extract the folder name from the link (repository name)
     folder = link.split('/')[-1].split('.')[0]
     # Create the full path for the cloned repository
@@ -126,58 +214,377 @@ def refactoring_miner(link):
         os.mkdir(folder)
 
     # Check if the refactorings.json file has already been created
-    if not os.path.exists(folder+"/done"):
+    if os.path.exists(folder+"/done"):
+        if not incremental:
+            return MINER_DONE
+        status = refactoring_miner_new_commits(path, folder, heap_mb)
+        if status == MINER_DONE:
+            open(folder+"/done", 'a').close()
+        if status is not None:
+            return status
+        # The analysed history was rewritten, the repository is mined again from scratch
+        os.remove(folder+"/done")
+        shutil.rmtree(folder+"/shards", ignore_errors=True)
+    if shard_size > 0:
+        # Mine the history in commit-range shards that can be resumed one by one
+        status = refactoring_miner_sharded(path, folder, heap_mb, workers or shard_workers)
+    else:
         if os.path.exists(folder + "/refactorings.json"):
             os.remove(folder+"/refactorings.json")
         # Run the RefactoringMiner tool and output to refactorings.json
-        subprocess.call([miner, "-a", path, "-json", folder+"/refactorings.json"])
+        status = run_miner(["-a", path, "-json", folder+"/refactorings.json"], folder, heap_mb)
+    if status == MINER_DONE:
         # Create an empty file to indicate that the refactorings have been extracted
         open(folder+"/done", 'a').close()
+    return status
+
+def analysed_head(folder):
+    # HEAD the catalog of the project was last built at, its refactorings were mined up to there
+    path = commit_catalog.catalog_path('./' + folder)
+    if not os.path.exists(path):
+        return None
+    catalog = commit_catalog.CommitCatalog(path)
+    try:
+        return catalog.meta('head') or None
+    finally:
+        catalog.close()
+
+def repo_head(path):
+    result = subprocess.run(["git", "-C", path, "rev-parse", "HEAD"], capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+def refactoring_miner_new_commits(path, folder, heap_mb=None):
+    # Mine the commits made after the analysed HEAD into refactorings.new.json, which the
+    # collect stage merges into refactorings.json. Returns None when the whole history has to be mined.
+    last_head = analysed_head(folder)
+    head = repo_head(path)
+    if last_head is None or head is None:
+        print(f"No analysed HEAD for {folder}, mining the whole history")
+        return None
+    if last_head == head:
+        return MINER_DONE
+    if subprocess.run(["git", "-C", path, "merge-base", "--is-ancestor", last_head, head], capture_output=True).returncode != 0:
+        print(f"{last_head} is no longer in the history of {folder}, mining the whole history")
+        return None
+    # RefactoringMiner -bc skips the start commit, which was mined by the earlier run
+    print(f"RefactoringMiner started for the commits of {folder} after {last_head[:7]}")
+    new_file = folder + "/refactorings.new.json"
+    # Until the new commits are mined the repository is not done, so a failed run is mined again
+    # from scratch next time (without the shards planned for the earlier HEAD) instead of
+    # having its catalog moved past the commits it missed
+    os.remove(folder+"/done")
+    shutil.rmtree(folder+"/shards", ignore_errors=True)
+    status = run_miner(["-bc", path, last_head, head, "-json", new_file], folder, heap_mb)
+    if status == MINER_DONE and not os.path.exists(new_file):
+        status = MINER_FAILED
+    if status != MINER_DONE and os.path.exists(new_file):
+        os.remove(new_file)
+    return status
+
+def run_miner(args, folder, heap_mb=None):
+    # Run RefactoringMiner with an explicit heap size, its output is appended to <folder>/miner.log
+    env = os.environ.copy()
+    if heap_mb:
+        # The RefactoringMiner launcher passes JAVA_OPTS to the JVM. Exiting on the first
+        # OutOfMemoryError lets the repository be requeued instead of hanging the JVM.
+        env['JAVA_OPTS'] = f"{env.get('JAVA_OPTS', '')} -Xmx{heap_mb}m -XX:+ExitOnOutOfMemoryError".strip()
+    log_file = folder + "/miner.log"
+    with open(log_file, 'a') as log:
+        start = log.tell()
+        exit_code = telemetry.call([miner] + args, stdout=log, stderr=subprocess.STDOUT, env=env)
+    if exit_code == 0:
+        return MINER_DONE
+    # Look for an OutOfMemoryError in what this run wrote to the log
+    with open(log_file, 'r', errors='ignore') as log:
+        log.seek(start)
+        for line in log:
+            if 'OutOfMemoryError' in line:
+                return MINER_OOM
+    return MINER_FAILED
+
+def plan_shards(path, folder):
+    # Split the first-parent history of HEAD into ranges of shard_size commits.
+    # The plan is saved so that a resumed run mines exactly the same shards.
+    plan_file = folder + "/shards/plan.json"
+    if os.path.exists(plan_file):
+        with open(plan_file, 'r') as file:
+            return json.load(file)
+
+    result = subprocess.run(["git", "-C", path, "rev-list", "--first-parent", "--reverse", "HEAD"],
+                            capture_output=True, text=True, check=True)
+    history = result.stdout.split()
+    # Each shard is (start, end]: RefactoringMiner -bc skips the start commit, which is
+    # either the root commit (nothing to detect) or the end of the previous shard
+    shards = []
+    for i in range(0, len(history) - 1, shard_size):
+        end = history[min(i + shard_size, len(history) - 1)]
+        shards.append({"index": len(shards), "start": history[i], "end": end})
+
+    os.makedirs(folder + "/shards", exist_ok=True)
+    with open(plan_file, 'w') as file:
+        json.dump(shards, file, indent=2)
+    return shards
+
+def run_miner_shard(path, folder, shard, heap_mb=None):
+    shard_file = f"{folder}/shards/{shard['index']}.json"
+    # A finished shard is checkpointed with its own done file
+    if os.path.exists(shard_file + ".done"):
+        return MINER_DONE
+    if os.path.exists(shard_file):
+        os.remove(shard_file)
+    print(f"RefactoringMiner shard {shard['index']} ({shard['start'][:7]}..{shard['end'][:7]}) started for {folder}")
+    status = run_miner(["-bc", path, shard['start'], shard['end'], "-json", shard_file], folder, heap_mb)
+    if status == MINER_DONE and not os.path.exists(shard_file):
+        status = MINER_FAILED
+    if status != MINER_DONE:
+        print(f"RefactoringMiner shard {shard['index']} failed for {folder} ({status})")
+        return status
+    open(shard_file + ".done", 'a').close()
+    return MINER_DONE
+
+def refactoring_miner_sharded(path, folder, heap_mb=None, workers=1):
+    shards = plan_shards(path, folder)
+    # Only the shards without a checkpoint are run again
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # The shard threads report their JVMs to the stage of the mining thread
+        run_shard = telemetry.bind(lambda shard: run_miner_shard(path, folder, shard, heap_mb))
+        statuses = list(executor.map(run_shard, shards))
+    failed = [status for status in statuses if status != MINER_DONE]
+    if failed:
+        print(f"{len(failed)} of {len(shards)} shards failed for {folder}, run again to resume them")
+        return MINER_OOM if MINER_OOM in failed else MINER_FAILED
 
-def run_thread(link):
-    print("Thread started for", link)
-    refactoring_miner(link)
-    print("RefactoringMiner completed for", link)
-    collect_refactoring_commits(link)
-    print("Commits collected for", link)
-    # Remove the repository folder after processing
+    # RefactoringMiner lists the newest commits first, so the newest shard goes first
+    shard_files = [f"{folder}/shards/{shard['index']}.json" for shard in reversed(shards)]
+    merge_shards(shard_files, folder + "/refactorings.json")
+    return MINER_DONE
+
+def merge_shards(shard_files, output_file):
+    # Stream the commits of every shard into a single refactorings.json
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, 'w') as file:
+        writer = JsonArrayWriter(file, 'commits')
+        for shard_file in shard_files:
+            for commit in iter_commits(shard_file):
+                writer.write(commit)
+        writer.close()
+    os.replace(tmp_file, output_file)
+
+def count_commits(path):
+    # Number of commits reachable from any ref, used as the cost of mining a repository
+    result = subprocess.run(["git", "-C", path, "rev-list", "--count", "--all"],
+                            capture_output=True, text=True)
+    try:
+        return int(result.stdout.strip())
+    except ValueError:
+        return 0
+
+def load_repo_costs():
+    # Optional {folder: number of commits} hints, e.g. from the project table of part 1
+    if not repo_costs_file or not os.path.exists(repo_costs_file):
+        return {}
+    with open(repo_costs_file, 'r') as file:
+        return json.load(file)
+
+def estimate_cost(link, costs):
+    # Extract the folder name from the link (repository name)
     folder = link.split('/')[-1].split('.')[0]
     path = git_root+"/"+folder
-    # Remove the repository folder after processing (linux)
-    try:
-        def remove_readonly(func, path, _):
-            "Clear the readonly bit and reattempt the removal"
-            os.chmod(path, stat.S_IWRITE)
-            func(path)
+    # An existing clone gives the exact number, then the mirror kept in the repository cache
+    # by an earlier job, otherwise fall back to the hints (None when there is no estimate)
+    if os.path.exists(path):
+        return count_commits(path)
+    mirror = repo_cache.mirror_path(link)
+    if os.path.exists(os.path.join(mirror, 'HEAD')):
+        return count_commits(mirror)
+    if folder in costs:
+        return int(costs[folder])
+    return None
 
-        shutil.rmtree(path, onerror=remove_readonly)
+def remove_repo(link):
+    # Extract the folder name from the link (repository name)
+    folder = link.split('/')[-1].split('.')[0]
+    path = git_root+"/"+folder
+    # Remove the working copy after processing, the mirror stays in the cache
+    try:
+        repo_cache.release(path)
     except Exception as e:
         print("Error removing repository", e)
-    print("Thread completed for", link)
+
+def clone_stage(pending, ready, prefetch_slots):
+    # Clone repositories ahead of the miners, at most prefetch_repos of them waiting
+    while True:
+        try:
+            order, link = pending.get_nowait()
+        except queue.Empty:
+            return
+        prefetch_slots.acquire()
+        print("Cloning", link)
+        folder = link.split('/')[-1].split('.')[0]
+        try:
+            with telemetry.stage(link, 'clone', paths=[git_root+"/"+folder]):
+                clone_repo(link)
+        except Exception as e:
+            # Nothing to mine: drop what the clone left behind and give its slot to the next repository
+            print("Error cloning repository", link, e, "- skipped")
+            remove_repo(link)
+            prefetch_slots.release()
+            continue
+        cost = count_commits(git_root+"/"+folder)
+        print(f"Cloned {link} ({cost} commits)")
+        # The biggest cloned repository is mined first
+        ready.put((-cost, order, link))
+
+def estimate_heap_mb(cost):
+    # Heap needed by one RefactoringMiner JVM, growing with the number of commits it walks
+    if shard_size > 0:
+        cost = min(cost, shard_size)
+    return int(min(heap_base_mb + heap_mb_per_1k_commits * cost / 1000, max_heap_mb))
+
+class MemoryBudget:
+    """Memory of the node committed to running RefactoringMiner JVMs."""
+
+    def __init__(self, total_mb):
+        self.total_mb = total_mb
+        self.committed_mb = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, mb):
+        # Wait until the request fits next to the running miners. A request bigger than
+        # the whole budget is capped and only runs alone.
+        mb = min(int(mb), self.total_mb)
+        with self.condition:
+            while self.committed_mb + mb > self.total_mb:
+                self.condition.wait()
+            self.committed_mb += mb
+        return mb
+
+    def release(self, mb):
+        with self.condition:
+            self.committed_mb -= mb
+            self.condition.notify_all()
+
+def node_memory_mb():
+    # Memory given to the job by SLURM (--mem), otherwise the physical memory of the node
+    if os.getenv('MEMORY_BUDGET_GB'):
+        return int(float(os.getenv('MEMORY_BUDGET_GB')) * 1024)
+    if os.getenv('SLURM_MEM_PER_NODE'):
+        return int(os.getenv('SLURM_MEM_PER_NODE'))
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+
+memory_budget = MemoryBudget(int(node_memory_mb() * memory_budget_ratio))
+# Biggest heap a single JVM can get on this node
+max_heap_mb = int(memory_budget.total_mb / jvm_overhead)
+
+def mining_stage(ready, prefetch_slots, collected):
+    while True:
+        neg_cost, order, link = ready.get()
+        if link is None:
+            return
+        attempt = miner_attempts.get(link, 0)
+        if attempt == 0:
+            # The repository left the prefetch window, let the next one be cloned
+            prefetch_slots.release()
+            miner_heaps[link] = estimate_heap_mb(-neg_cost)
+        heap_mb = miner_heaps[link]
+        # Retries after an OutOfMemoryError run their shards one at a time
+        workers = shard_workers if shard_size > 0 and attempt == 0 else 1
+        # Only start the miner once its heap fits in the memory left on the node
+        reserved = memory_budget.acquire(heap_mb * jvm_overhead * workers)
+        print(f"Thread started for {link} (heap {heap_mb} MB, {memory_budget.committed_mb} MB committed)")
+        status = MINER_FAILED
+        folder = link.split('/')[-1].split('.')[0]
+        try:
+            with telemetry.stage(link, 'miner', paths=[folder], heap_mb=heap_mb, workers=workers,
+                                 attempt=attempt, cost=-neg_cost) as record:
+                status = refactoring_miner(link, heap_mb, workers)
+                record['status'] = status
+            print("RefactoringMiner completed for", link, status)
+        except Exception as e:
+            print("Error running RefactoringMiner for", link, e)
+        finally:
+            memory_budget.release(reserved)
+
+        if status == MINER_OOM and attempt < oom_retries and heap_mb < max_heap_mb:
+            # Requeue with twice the heap, which also leaves room for fewer miners next to it
+            miner_attempts[link] = attempt + 1
+            miner_heaps[link] = min(heap_mb * 2, max_heap_mb)
+            print(f"RefactoringMiner ran out of memory for {link}, requeued with {miner_heaps[link]} MB")
+            ready.put((neg_cost, order, link))
+            continue
+        collected.put(link)
+
+def collect_stage(collected):
+    while True:
+        link = collected.get()
+        if link is None:
+            return
+        folder = link.split('/')[-1].split('.')[0]
+        try:
+            with telemetry.stage(link, 'collect', paths=[folder]):
+                collect_refactoring_commits(link)
+            print("Commits collected for", link)
+        except Exception as e:
+            print("Error collecting commits for", link, e)
+        try:
+            # Catalog the history while the clone is still there
+            with telemetry.stage(link, 'catalog', paths=[folder]):
+                build_catalog(link)
+            print("Catalog built for", link)
+        except Exception as e:
+            print("Error building the catalog for", link, e)
+        with telemetry.stage(link, 'cleanup'):
+            remove_repo(link)
+        print("Thread completed for", link)
+
+def start_threads(count, target, args):
+    threads = []
+    for _ in range(count):
+        t = threading.Thread(target=target, args=args)
+        t.start()
+        threads.append(t)
+    return threads
 
 def main():
     # Path to the file containing project links
     file_path = 'projects.txt'
-    threads = [] # List to hold threads
     # Retrieve the list of links from the file
-    links = getlinks(file_path)
-
-    # Iterate through each link
-    for link in links:
-        while threading.active_count() > max_threads:
-            time.sleep(0.1)
-
-        # Clone the repository
-        clone_repo(link)
-        # Create a new thread for processing each link
-        t = threading.Thread(target=run_thread, args=(link,))
-        threads.append(t) # Add the thread to the list
-        t.start() # Start the thread
-    
-    # Wait for all threads to complete
-    for t in threads:
+    links = [link for link in getlinks(file_path) if link]
+
+    # Longest job first: start with the biggest repositories so that they do
+    # not keep a single core busy at the end of the job
+    costs = load_repo_costs()
+    estimates = {link: estimate_cost(link, costs) for link in links}
+    unknown = sum(1 for cost in estimates.values() if cost is None)
+    if unknown:
+        print(f"Warning: no size estimate for {unknown}/{len(links)} repositories (no clone, no mirror in "
+              f"{repo_cache.CACHE_DIR} and no REPO_COSTS entry), they are started after the others in file order")
+    links.sort(key=lambda link: estimates[link] or 0, reverse=True)
+
+    pending = queue.Queue()        # Repositories waiting to be cloned
+    ready = queue.PriorityQueue()  # Cloned repositories waiting for a mining slot
+    collected = queue.Queue()      # Mined repositories waiting for commit collection and cleanup
+    prefetch_slots = threading.Semaphore(prefetch_repos)
+    for order, link in enumerate(links):
+        pending.put((order, link))
+
+    clone_threads = start_threads(num_clone_threads, clone_stage, (pending, ready, prefetch_slots))
+    mining_threads = start_threads(max_threads, mining_stage, (ready, prefetch_slots, collected))
+    collect_threads = start_threads(num_collect_threads, collect_stage, (collected,))
+
+    # Each stage is stopped with one sentinel per thread once the previous one is done,
+    # the mining sentinels sort after every real repository in the priority queue
+    for t in clone_threads:
         t.join()
-        
+    for _ in mining_threads:
+        ready.put((float('inf'), float('inf'), None))
+    for t in mining_threads:
+        t.join()
+    for _ in collect_threads:
+        collected.put(None)
+    for t in collect_threads:
+        t.join()
+
 # Entry point of the script
 if __name__ == "__main__":
     main()
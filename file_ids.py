@@ -0,0 +1,83 @@
+# Stable identity of the files of a repository across renames.
+# The history is followed in order, every added or copied file gets a new integer ID and a
+# renamed file keeps the ID of its old path. The metric scripts key their per-file state
+# by these IDs, in plain lists, instead of moving dictionary entries around whenever a
+# file is renamed or moved to another package, and files keep their history after a rename.
+
+from git_log_parser import iter_log
+
+
+class FileIds:
+    """Assigns file IDs while the commits are read in order (parents before children)."""
+
+    def __init__(self):
+        self.current = {}   # path -> ID of the file at that path now
+        self.paths = []     # ID -> latest path of the file
+        self.by_commit = {} # (commit hash, path) -> ID, filled when record=True
+        self.record = False
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _new(self, path):
+        file_id = len(self.paths)
+        self.paths.append(path)
+        return file_id
+
+    def resolve(self, old_path, new_path, change_type):
+        """
+        ID of a file touched by the next commit
+        Input: old_path, new_path: str or None, like in pydriller and git_log_parser
+               change_type: str, name of the change (ADD, COPY, RENAME, DELETE, MODIFY, ...)
+        Output: int
+        """
+        if change_type == 'DELETE':
+            file_id = self.current.pop(old_path, None)
+            return file_id if file_id is not None else self._new(old_path)
+        if change_type == 'RENAME' and old_path in self.current:
+            file_id = self.current.pop(old_path)
+        elif change_type in ('ADD', 'COPY'):
+            # A path added again after a deletion is a new file
+            file_id = self._new(new_path)
+        else:
+            file_id = self.current.get(new_path)
+            if file_id is None:
+                file_id = self._new(new_path)
+        self.current[new_path] = file_id
+        self.paths[file_id] = new_path
+        return file_id
+
+    def commit_ids(self, commit):
+        """
+        IDs of the files of a commit, in the order of commit.modified_files
+        Input: commit: pydriller Commit or git_log_parser.CommitRecord
+        Output: list of int
+        """
+        return [self.assign(commit.hash, mod.old_path, mod.new_path, mod.change_type.name)
+                for mod in commit.modified_files]
+
+    def assign(self, commit_hash, old_path, new_path, change_type):
+        # Same as resolve, also recording the (commit, path) -> ID mapping when asked to
+        file_id = self.resolve(old_path, new_path, change_type)
+        if self.record:
+            for path in (old_path, new_path):
+                if path is not None:
+                    self.by_commit[(commit_hash, path)] = file_id
+        return file_id
+
+    def file_id(self, commit_hash, path):
+        """ID of a path touched by a commit, once the history was resolved with record=True."""
+        return self.by_commit.get((commit_hash, path))
+
+    @classmethod
+    def build(cls, repo_path):
+        """
+        Resolve the whole history of a repository in one pass
+        Input: repo_path: str
+        Output: FileIds with the (commit, path) -> ID mapping of every file change
+        """
+        file_ids = cls()
+        file_ids.record = True
+        for commit in iter_log(repo_path, extra_args=['--topo-order']):
+            file_ids.commit_ids(commit)
+        return file_ids
@@ -1,5 +1,7 @@
 import json
 
+from refactorings_reader import filter_refactorings
+
 def keep_refactorings(commits):
     print(f"Number of initial commits: {len(commits['commits'])}")
     refactorings = [commit for commit in commits["commits"] if commit['refactorings']]
@@ -16,9 +18,12 @@ def save_refactorings(refactorings:list, file_path:str):
 
 def main():
     # Change paths according to your file structure
-    commits = load_commits('Example_data\\core\\refactorings.json')
-    refactorings = keep_refactorings(commits)
-    save_refactorings(refactorings, 'Example_data\\core\\only_refactorings.json')
+    # Stream the file instead of loading it whole, refactorings.json can be several GB
+    total, kept = filter_refactorings('Example_data\\core\\refactorings.json',
+                                      'Example_data\\core\\only_refactorings.json',
+                                      indent=4)
+    print(f"Number of initial commits: {total}")
+    print(f"Number of commits with refactorings: {kept}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
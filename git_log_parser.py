@@ -0,0 +1,224 @@
+# Fast commit history reader shared by the mining and metric scripts.
+# A single `git log --raw --numstat -M -z` per repository is parsed into lightweight
+# commit records, instead of letting pydriller spawn the diff machinery and build a
+# ModifiedFile object for every file of every commit. The records use the same
+# attribute names as pydriller (hash, msg, author.name, committer_date,
+# modified_files, new_path, added_lines, change_type.name, ...) so the metric code
+# can consume them in place of a pydriller traversal when it only needs metadata.
+
+import os
+import subprocess
+import tempfile
+from collections import namedtuple
+from datetime import datetime
+from enum import Enum
+
+Developer = namedtuple('Developer', ['name', 'email'])
+
+# Marks the start of every commit in the log stream
+COMMIT_MARKER = b'\x1e\x1e\x1e'
+FIELD_SEPARATOR = '\x1f'
+LOG_FORMAT = '%x1e%x1e%x1e' + '%x1f'.join(['%H', '%P', '%an', '%ae', '%aI', '%cn', '%ce', '%cI', '%B']) + '%x1f'
+NULL_BLOB = '0' * 40
+READ_SIZE = 1 << 20
+
+
+class GitLogError(subprocess.CalledProcessError):
+    """git log ended with an error, its message is kept in stderr."""
+
+    def __str__(self):
+        return f"{super().__str__()}: {self.stderr}"
+
+
+class ChangeType(Enum):
+    """Same names as pydriller's ModificationType."""
+    ADD = 1
+    COPY = 2
+    RENAME = 3
+    DELETE = 4
+    MODIFY = 5
+    UNKNOWN = 6
+
+
+_CHANGE_TYPES = {
+    'A': ChangeType.ADD,
+    'C': ChangeType.COPY,
+    'R': ChangeType.RENAME,
+    'D': ChangeType.DELETE,
+    'M': ChangeType.MODIFY,
+    'T': ChangeType.MODIFY,
+}
+
+
+class FileRecord:
+    """A file touched by a commit."""
+    __slots__ = ('old_path', 'new_path', 'change_type', 'added_lines', 'deleted_lines',
+                 'old_blob', 'new_blob', 'diff')
+
+    def __init__(self, old_path, new_path, change_type, old_blob, new_blob):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.change_type = change_type
+        self.old_blob = old_blob
+        self.new_blob = new_blob
+        self.added_lines = 0
+        self.deleted_lines = 0
+        self.diff = ''
+
+    @property
+    def filename(self):
+        return os.path.basename(self.new_path if self.new_path is not None else self.old_path)
+
+    def __repr__(self):
+        return f"FileRecord({self.change_type.name} {self.old_path} -> {self.new_path})"
+
+
+class CommitRecord:
+    """A commit of the log, with the files it touched when they were requested."""
+    __slots__ = ('hash', 'parents', 'author', 'author_date', 'committer', 'committer_date',
+                 'msg', 'modified_files')
+
+    @property
+    def merge(self):
+        return len(self.parents) > 1
+
+    @property
+    def insertions(self):
+        return sum(file.added_lines for file in self.modified_files)
+
+    @property
+    def deletions(self):
+        return sum(file.deleted_lines for file in self.modified_files)
+
+    def __repr__(self):
+        return f"CommitRecord({self.hash})"
+
+
+def _parse_files(data, patch):
+    # --raw entries come first (":<modes> <blobs> <status>\0<path>\0[<path>\0]"),
+    # then the --numstat entries in the same order, then the patch if requested
+    tokens = data.split(b'\x00')
+    files = []
+    i = 0
+    while i < len(tokens) and tokens[i].startswith(b':'):
+        meta = tokens[i].decode('ascii').split()
+        status = meta[4][0]
+        change_type = _CHANGE_TYPES.get(status, ChangeType.UNKNOWN)
+        if status in 'RC':
+            old_path, new_path = tokens[i + 1], tokens[i + 2]
+            i += 3
+        else:
+            old_path = new_path = tokens[i + 1]
+            i += 2
+        old_path = old_path.decode('utf-8', 'surrogateescape')
+        new_path = new_path.decode('utf-8', 'surrogateescape')
+        if change_type == ChangeType.ADD:
+            old_path = None
+        elif change_type == ChangeType.DELETE:
+            new_path = None
+        old_blob = meta[2] if meta[2] != NULL_BLOB else None
+        new_blob = meta[3] if meta[3] != NULL_BLOB else None
+        files.append(FileRecord(old_path, new_path, change_type, old_blob, new_blob))
+
+    for file in files:
+        if i >= len(tokens):
+            break
+        added, deleted, path = tokens[i].split(b'\t', 2)
+        # Renames and copies give their paths in the two following tokens
+        i += 3 if path == b'' else 1
+        # Binary files are reported as "-"
+        file.added_lines = int(added) if added != b'-' else 0
+        file.deleted_lines = int(deleted) if deleted != b'-' else 0
+
+    if patch and i < len(tokens):
+        sections = b'\x00'.join(tokens[i:]).split(b'\ndiff --git ')
+        for file, section in zip(files, sections):
+            file.diff = _file_diff(section)
+    return files
+
+
+def _file_diff(section):
+    # Same text as pydriller's ModifiedFile.diff, which commits.json is written from: from the
+    # first hunk (or the "Binary files ... differ" line) to the end of the patch of the file with
+    # its last newline, each file decoded on its own with the invalid UTF-8 bytes dropped
+    start = section.find(b'\n@@')
+    if start == -1:
+        start = section.find(b'\nBinary files ')
+    if start == -1:
+        return ''
+    # Every line of a patch has a prefix, so the newlines at the end only separate the commits
+    return section[start + 1:].rstrip(b'\n').decode('utf-8', 'ignore') + '\n'
+
+
+def _parse_commit(data, files, patch):
+    header, _, rest = data.partition(b'\x1f\x00') if files else (data, None, b'')
+    fields = header.decode('utf-8', 'replace').split(FIELD_SEPARATOR)
+    commit = CommitRecord()
+    commit.hash = fields[0]
+    commit.parents = fields[1].split()
+    commit.author = Developer(fields[2], fields[3])
+    commit.author_date = datetime.fromisoformat(fields[4])
+    commit.committer = Developer(fields[5], fields[6])
+    commit.committer_date = datetime.fromisoformat(fields[7])
+    commit.msg = fields[8].strip()
+    commit.modified_files = _parse_files(rest.lstrip(b'\x00\n'), patch) if files else []
+    return commit
+
+
+def iter_log(repo_path, rev='HEAD', files=True, patch=False, reverse=True, extra_args=()):
+    """
+    Stream the history of a repository as lightweight commit records
+    Input: repo_path: str
+           rev: str or list of str, revisions given to git log (e.g. 'HEAD', 'a..b')
+           files: bool, parse the touched files with their line counts and blob ids
+           patch: bool, also fill FileRecord.diff (much more expensive)
+           reverse: bool, oldest commit first like pydriller
+           extra_args: more git log arguments (e.g. ['--no-merges'])
+    Output: generator of CommitRecord
+    """
+    cmd = ['git', '-C', repo_path, '-c', 'core.quotepath=off', 'log', '--format=' + LOG_FORMAT]
+    if files:
+        cmd += ['--raw', '--numstat', '-M', '-z', '--no-abbrev']
+        if patch:
+            cmd.append('-p')
+    if reverse:
+        cmd.append('--reverse')
+    cmd += list(extra_args)
+    cmd += [rev] if isinstance(rev, str) else list(rev)
+    cmd.append('--')
+
+    # git's messages go to a file, a pipe could fill up while stdout is being read
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+    try:
+        buffer = bytearray()
+        # Where the search for the next marker starts: the data before it has been searched already
+        searched = 0
+        while True:
+            chunk = process.stdout.read(READ_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+            start = 0
+            end = buffer.find(COMMIT_MARKER, searched)
+            while end != -1:
+                if end > start:
+                    yield _parse_commit(bytes(buffer[start:end]), files, patch)
+                start = end + len(COMMIT_MARKER)
+                end = buffer.find(COMMIT_MARKER, start)
+            # What is left may still be incomplete. A marker can be cut at the end of the chunk,
+            # so its last bytes are searched again with the next one.
+            del buffer[:start]
+            searched = max(0, len(buffer) - len(COMMIT_MARKER) + 1)
+        # A bad path or revision gives an empty stream, which must not pass for an empty history
+        if process.wait() != 0:
+            errors.seek(0)
+            raise GitLogError(process.returncode, cmd, stderr=errors.read().decode('utf-8', 'replace').strip())
+        if buffer:
+            yield _parse_commit(bytes(buffer), files, patch)
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+        errors.close()
+
@@ -2,8 +2,8 @@
 #SBATCH --job-name=Refactoring      # Job name
 #SBATCH --account=project_2011276   # Billing project, has to be defined!
 #SBATCH --time=70:00:00             # Max. duration of the job
-#SBATCH --mem=1400G                 # Memory pool for all cores
-#SBATCH --partition=hugemem         # Job queue (partition)
+#SBATCH --mem=373G                  # Memory pool for all cores, shared out between the miners by csc-refactdrill.py
+#SBATCH --partition=small           # Job queue (partition)
 #SBATCH --cpus-per-task=40          # Number of cores per task
 #SBATCH --nodes=1                   # Number of nodes, ensure that all cores are on the same node
 #SBATCH --ntasks=1                  # Number of tasks, assign all cores to one task
@@ -16,22 +16,49 @@ pip3 install --user pydriller
 
 # Set the number of threads to the number of cores per task
 export NUM_THREADS=$SLURM_CPUS_PER_TASK
+# Number of repositories cloned ahead of the miners, and threads of the clone and collect stages
+export PREFETCH_REPOS=4
+export CLONE_THREADS=2
+export COLLECT_THREADS=2
+# 0 runs RefactoringMiner -a once per repository, over all its branches. A size such as 5000 mines
+# each repository in checkpointed shards, but only over the first-parent history of HEAD
+export SHARD_SIZE=0
+export SHARD_WORKERS=1
+# RefactoringMiner heap: 2 GB plus 100 MB per thousand commits, doubled after an OutOfMemoryError
+export HEAP_BASE_MB=2048
+export HEAP_MB_PER_1K_COMMITS=100
+export OOM_RETRIES=3
+# Write commits.jsonl.gz with each diff stored once instead of the indented commits.json
+export COMMITS_FORMAT=jsonl.gz
+# Stage timings and resource usage of every repository, summarized by python telemetry.py
+export TELEMETRY_FILE=telemetry.jsonl
+# Set to 1 to only mine and collect the commits made since the last run of each repository
+export INCREMENTAL=0
 
 # Define paths
 export PROJAPPL_DIR="/projappl/project_2011276" # Project application directory
 export SCRATCH_DIR="/scratch/project_2011276" # Scratch directory on Puhti
 export GIT_REPOS_ROOT="$SCRATCH_DIR/git_repos" # Local scratch directory on local NVMe disk
 export RUN_DIR="$SCRATCH_DIR/run" # Local scratch directory on local NVMe disk
+export REPO_CACHE_DIR="$SCRATCH_DIR/repo_cache" # Bare mirrors shared by all the pipeline stages
+export REPO_CACHE_QUOTA_GB=1000 # Least recently used mirrors are evicted above this size
 
 # Ensure that the directories exist
 mkdir -p "$GIT_REPOS_ROOT"
 mkdir -p "$RUN_DIR"
+mkdir -p "$REPO_CACHE_DIR"
 
 # Change to the local NVMe disk scratch directory
 cd "$RUN_DIR" || exit
 
-# Copy script and projects.txt file to the local scratch directory
+# Copy scripts and projects.txt file to the local scratch directory
 cp "$PROJAPPL_DIR/csc-refactdrill.py" .
+cp "$PROJAPPL_DIR/refactorings_reader.py" .
+cp "$PROJAPPL_DIR/repo_cache.py" .
+cp "$PROJAPPL_DIR/commits_store.py" .
+cp "$PROJAPPL_DIR/telemetry.py" .
+cp "$PROJAPPL_DIR/git_log_parser.py" .
+cp "$PROJAPPL_DIR/commit_catalog.py" .
 cp "$PROJAPPL_DIR/projects.txt" .
 
 # Set refactoring miner path
@@ -1,24 +1,24 @@
 # A script that outputs CK metrics using Multiprocessing of all URLs listed in a txt file. Just hard-code the path of the txt file in the global variable "PROJECTS_TXT"
+# The refactoring commits of every project are shared out between the processes, each of them checking
+# its commits out in its own git worktree of the project.
 
 
 import os
 import subprocess
 import json
-import shutil
-import stat
+import sys
 from multiprocessing import Pool
 
+# The shared helpers live at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import repo_cache
+
 # Paths configuration
 SHA1_VALUES_DIR = "C:\\Users\\testu\\Desktop\\realWork\\sha1_values_refactorings"
 PROJECTS_TXT = "C:\\Users\\testu\\Desktop\\realWork\\exampleProjects.txt"
 CK_JAR_PATH = "C:\\Users\\testu\\Desktop\\realWork\\ck\\target\\ck-0.7.1-SNAPSHOT-jar-with-dependencies.jar"
 OUTPUT_DIR = "C:\\Users\\testu\\Desktop\\realWork\\Metrics"
 
-# Helper function to handle read-only files during deletion
-def remove_readonly(func, path, excinfo):
-    os.chmod(path, stat.S_IWRITE)
-    func(path)
-
 # Function to read GitHub project URLs from the text file
 def read_project_links(file_path):
     with open(file_path, 'r') as f:
@@ -35,46 +35,73 @@ def load_sha1_values(project_name):
         print(f"Error reading JSON for project {project_name}: {e}")
         return []
 
-# Function to clone repository if it doesn't exist locally
+# Function to get a working copy of the repository from the shared cache if it doesn't exist locally
 def clone_repo(repo_url, project_dir):
     if not os.path.exists(project_dir):
         print(f"Cloning repository {repo_url} into {project_dir}")
-        subprocess.run(["git", "clone", repo_url, project_dir], check=True)
+        repo_cache.checkout(repo_url, project_dir)
+
+# Worktrees of this worker process, by project directory. Each process checks its commits out
+# in its own worktree, so several commits of a project are analysed at once.
+_worktrees = {}
+
+def worktrees_dir(project_dir):
+    return project_dir + "-worktrees"
+
+# Function to get the worktree of this process for a project, created on first use
+def worktree(project_dir):
+    path = _worktrees.get(project_dir)
+    if path is None or not os.path.exists(path):
+        path = os.path.join(worktrees_dir(project_dir), str(os.getpid()))
+        subprocess.run(["git", "-C", project_dir, "worktree", "add", "--detach", path], check=True)
+        _worktrees[project_dir] = path
+    return path
 
 # Function to run CK metrics for a specific commit
 def run_ck(project_dir, commit_hash, output_dir):
-    os.chdir(project_dir)
-    subprocess.run(["git", "checkout", commit_hash], check=True)
+    work_dir = worktree(project_dir)
+    subprocess.run(["git", "-C", work_dir, "checkout", "--quiet", "--force", "--detach", commit_hash], check=True)
     project_name = os.path.basename(project_dir)
     ck_output_dir = os.path.join(output_dir, project_name, commit_hash)
     os.makedirs(ck_output_dir, exist_ok=True)
     ck_command = [
         "java", "-jar", CK_JAR_PATH,
-        project_dir, "false", "0", "false", ck_output_dir
+        work_dir, "false", "0", "false", ck_output_dir
     ]
     subprocess.run(ck_command, check=True)
 
-# Function to process a single project
-def process_project(repo_url):
+# Function to get a project ready for the analysis of its commits
+def prepare_project(repo_url):
     project_name = repo_url.split("/")[-1].replace(".git", "")
     print(f"Processing project {project_name}")
     sha1_values = load_sha1_values(project_name)
     if not sha1_values:
         print(f"No sha1 values found for {project_name}, skipping...")
-        return
+        return None
     
     project_dir = os.path.join("C:\\Users\\testu\\Desktop\\realWork\\Repos", project_name)
     clone_repo(repo_url, project_dir)
-    
-    for commit_hash in sha1_values:
-        try:
-            run_ck(project_dir, commit_hash, OUTPUT_DIR)
-        except subprocess.CalledProcessError as e:
-            print(f"Error processing commit {commit_hash} for {project_name}: {e}")
-    
+    # Worktrees left behind by a run that was stopped
+    repo_cache.release(worktrees_dir(project_dir))
+    subprocess.run(["git", "-C", project_dir, "worktree", "prune"], check=True)
+    return project_dir, sha1_values
+
+# Function to process a single (project, commit) pair
+def process_commit(task):
+    project_dir, commit_hash = task
+    try:
+        run_ck(project_dir, commit_hash, OUTPUT_DIR)
+    except subprocess.CalledProcessError as e:
+        print(f"Error processing commit {commit_hash} for {os.path.basename(project_dir)}: {e}")
+    return project_dir
+
+# Function to delete a project and its worktrees once all its commits are analysed
+def clean_up_project(project_dir):
+    project_name = os.path.basename(project_dir)
     print(f"Cleaning up repository for {project_name}")
     try:
-        shutil.rmtree(project_dir, onerror=remove_readonly)
+        repo_cache.release(worktrees_dir(project_dir))
+        repo_cache.release(project_dir)
         print(f"Deleted repository folder {project_name}")
     except Exception as e:
         print(f"Failed to delete repository {project_name}: {e}")
@@ -82,10 +109,19 @@ def process_project(repo_url):
 # Main script with multiprocessing
 def main():
     project_links = read_project_links(PROJECTS_TXT)
-    max_workers = min(os.cpu_count(), len(project_links))  # Limit number of processes to CPU count or number of projects
     
-    with Pool(processes=max_workers) as pool:
-        pool.map(process_project, project_links)
+    with Pool(processes=os.cpu_count()) as pool:
+        projects = [project for project in pool.map(prepare_project, project_links) if project]
+        # The work is shared out by commit rather than by project, so a project with many refactoring
+        # commits keeps every process busy. The largest projects go first, and the commits of a
+        # project are queued together, so only a few projects have worktrees at the same time.
+        projects.sort(key=lambda project: len(project[1]), reverse=True)
+        remaining = {project_dir: len(sha1_values) for project_dir, sha1_values in projects}
+        tasks = [(project_dir, commit_hash) for project_dir, sha1_values in projects for commit_hash in sha1_values]
+        for project_dir in pool.imap_unordered(process_commit, tasks):
+            remaining[project_dir] -= 1
+            if remaining[project_dir] == 0:
+                clean_up_project(project_dir)
 
 if __name__ == "__main__":
     main()
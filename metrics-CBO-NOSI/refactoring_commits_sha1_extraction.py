@@ -2,6 +2,11 @@
 
 import json
 import os
+import sys
+
+# The shared helpers live at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from refactorings_reader import filter_refactorings
 
 def extract_sha1_with_refactorings(commits):
     """Extracts sha1 values from commits that have refactorings."""
@@ -54,25 +59,39 @@ def process_project(project_name: str, parent_folder: str, output_folder: str):
         print(f"Error: 'refactorings.json' not found in {project_name}")
         return
 
-    # Load commits and extract sha1 values for commits with refactorings
-    commits = load_commits(input_path)
-    
-    if commits is None:
-        # If loading the commits failed (due to a JSON error), skip this project
-        return
-    
-    sha1_values = extract_sha1_with_refactorings(commits)
-    
     # Prepare the output file path for this project
     output_path = os.path.join(output_folder, project_name, 'refactoring_commits_sha1_values.json')
 
     # Ensure the project output directory exists
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-    # Save sha1 values to the output file
-    save_sha1_values(sha1_values, output_path)
+    # Stream the commits and save the sha1 values of the ones with refactorings in the same pass
+    if not stream_sha1_values(input_path, output_path):
+        # If reading the commits failed (due to a JSON error), skip this project
+        return
     print(f"Sha1 values for project '{project_name}' saved to {output_path}")
 
+def stream_sha1_values(input_path: str, output_path: str):
+    """Streams the commits of a refactorings.json file and saves the sha1 values of those with refactorings, without loading the whole file."""
+    try:
+        # Try with UTF-8 encoding first
+        filter_refactorings(input_path, sha1_file=output_path, encoding='utf-8')
+        return True
+    except json.JSONDecodeError as e:
+        print(f"Error: Failed to parse JSON in file: {input_path}")
+        print(f"Error details: {e}")
+        return False
+    except UnicodeDecodeError as e:
+        # Try with ISO-8859-1 encoding if UTF-8 fails
+        print(f"Error: Failed to decode file '{input_path}' using UTF-8. Trying ISO-8859-1 encoding.")
+        try:
+            filter_refactorings(input_path, sha1_file=output_path, encoding='ISO-8859-1')
+            return True
+        except json.JSONDecodeError as e:
+            print(f"Error: Failed to parse JSON in file: {input_path} with ISO-8859-1 encoding.")
+            print(f"Error details: {e}")
+            return False
+
 def main():
     # Define input and output directories
     parent_folder = './all_projects_commits_info'  # Parent folder that contains project folders
@@ -1,9 +1,15 @@
 import json
 import os
-import subprocess
-from pydriller import Repository
-import collections
-import codecs
+import sys
+
+# The shared helpers live at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from commits_store import has_commits, load_commit_entries
+from path_index import PathIndex
+from commit_catalog import catalog_path, open_catalog
+from blame_cache import BlameCache, cache_file
+from checkpoints import INCREMENTAL
+from refactorings_reader import iter_commits
 
 GIT_ROOT = 'E:/Data/git_repos'
 BASE_PATH = 'C:/Data/Koulu/University of Oulu/CSC-Puhti'
@@ -17,174 +23,138 @@ def is_same_path(path1, path2):
         path2 = '/' + path2
     return os.path.normpath(path1) == os.path.normpath(path2)
 
-def safe_read_file(file_path):
-    """Attempts to read a file using different encodings."""
-    encodings = ['utf-8', 'latin-1', 'cp1252', 'ascii']
-    
-    for encoding in encodings:
-        try:
-            with codecs.open(file_path, 'r', encoding=encoding) as f:
-                return f.read()
-        except UnicodeDecodeError:
-            continue
-    
-    # If all encodings fail, try with 'ignore' error handler
+def load_refactoring_hashes(file_path):
+    """
+    Hashes of the commits of a refactorings.json file, in the order of the file (newest first).
+    The file can be several gigabytes large, so it is streamed and only the hashes are kept.
+    Input: file_path: str
+    Output: list of str
+    """
     try:
-        with codecs.open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            return f.read()
-    except Exception as e:
-        print(f"Error reading file {file_path}: {e}")
-        return None
-
-def get_blame_info(repo_path, commit_hash, file_path):
-    try:
-        # Set PYTHONIOENCODING environment variable
-        env = os.environ.copy()
-        env['PYTHONIOENCODING'] = 'utf-8'
-        
-        cmd = ['git', '-C', repo_path, 'blame', commit_hash, '--', file_path]
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            errors='ignore',
-            env=env
-        )
-        return result.stdout
-    except subprocess.SubprocessError as e:
-        print(f"Error in git blame command: {e}")
-        return ""
-    except UnicodeDecodeError as e:
-        print(f"Unicode decode error in git blame: {e}")
-        # Try with different encoding
-        try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                encoding='latin-1',
-                errors='ignore',
-                env=env
-            )
-            return result.stdout
-        except Exception as e:
-            print(f"Failed to get blame info: {e}")
-            return ""
-
-def calculate_own(blame_info):
-    if not blame_info:
-        return 0
-        
-    lines = blame_info.split('\n')
-    author_lines = collections.Counter()
-
-    for line in lines:
-        if line:
-            try:
-                author = line.split('(')[1].split(' ')[0]
-                author_lines[author] += 1
-            except (IndexError, ValueError) as e:
-                print(f"Error parsing blame line: {e}")
-                continue
+        return [commit['sha1'] for commit in iter_commits(file_path, 'utf-8')]
+    except UnicodeDecodeError:
+        # latin-1 decodes any byte, so it reads whatever the file holds
+        return [commit['sha1'] for commit in iter_commits(file_path, 'latin-1')]
 
+def calculate_own(author_lines):
+    # author_lines: {author name: number of lines} from the blame of the file
     total_lines = sum(author_lines.values())
     if total_lines == 0:
         return 0
 
-    highest_contributor_lines = max(author_lines.values()) if author_lines else 0
+    highest_contributor_lines = max(author_lines.values())
     own_percentage = (highest_contributor_lines / total_lines) * 100
     return own_percentage
 
-def get_metrics(considered_commit, refactoring_commits, file_path, repo, repo_path):
-    metrics = {
-        'COMM': 0,
-        'ADEV': set(),
-        'DDEV': set(),
-        'ADD': 0,
-        'DEL': 0,
-        'OWN': 0
-    }
-    total_added_lines = 0
-    total_deleted_lines = 0
-
-    metric_found = False
-    for commit in repo:
-        for mod in commit.modified_files:
-            if is_same_path(mod.new_path, file_path) or is_same_path(mod.old_path, file_path):
-                metric_found = True
-                metrics['COMM'] += 1
-                metrics['ADEV'].add(commit.author.email)
-                metrics['DDEV'].add(commit.author.email)
-                metrics['ADD'] += mod.added_lines
-                metrics['DEL'] += mod.deleted_lines
-                total_added_lines += mod.added_lines
-                total_deleted_lines += mod.deleted_lines
-
-    if metric_found:
-        blame_info = get_blame_info(repo_path, considered_commit['commit_hash'], file_path)
-        metrics['OWN'] = calculate_own(blame_info)
-
-    if not metric_found:
+def get_metrics(considered_commit, file_path, index, start, end, blame):
+    # Commits touching the file between the previous refactoring commit and this one,
+    # answered by the path index instead of walking the history again for every file.
+    # The file is followed by its ID, so the commits made before a rename are counted too
+    commits, authors, added_lines, deleted_lines = index.query(file_path, start, end, considered_commit['commit_hash'])
+    if not commits:
         return None
-        
-    metrics['ADEV'] = len(metrics['ADEV'])
-    metrics['DDEV'] = len(metrics['DDEV'])
-    metrics['ADD'] /= total_added_lines if total_added_lines else 1
-    metrics['DEL'] /= total_deleted_lines if total_deleted_lines else 1
 
+    # A file that did not change since an earlier refactoring commit is not blamed again
+    author_lines = blame.author_lines(considered_commit['commit_hash'], file_path)
+    metrics = {
+        'COMM': commits,
+        'ADEV': len(authors),
+        'DDEV': len(authors),
+        'ADD': added_lines / (added_lines if added_lines else 1),
+        'DEL': deleted_lines / (deleted_lines if deleted_lines else 1),
+        'OWN': calculate_own(author_lines)
+    }
     return metrics
 
-def process_repository(repo_path, repo_name):
+def load_inputs(repo_path):
+    """
+    Read the collected commits and the refactorings of a project folder
+    Input: repo_path: str, folder with commits.json (or commits.jsonl.gz) and refactorings.json
+    Output: (list of commit entries, list of the hashes of refactorings.json), or None when they cannot be read
+    """
     try:
-        commits_content = safe_read_file(os.path.join(repo_path, 'commits.json'))
-        refactorings_content = safe_read_file(os.path.join(repo_path, 'refactorings.json'))
-        
-        if commits_content is None or refactorings_content is None:
+        if not has_commits(repo_path):
             print(f"Could not read JSON files in {repo_path}")
-            return
-            
-        commits = json.loads(commits_content)
-        refactorings = json.loads(refactorings_content)['commits']
-    except (json.JSONDecodeError, FileNotFoundError) as e:
+            return None
+
+        # Only the hashes of refactorings.json are used, and they are read without loading the file
+        refactorings = load_refactoring_hashes(os.path.join(repo_path, 'refactorings.json'))
+        # Only the paths of the diffs are used, so their text is not loaded
+        # (commits.json or commits.jsonl.gz, whichever the project was collected with)
+        commits = load_commit_entries(repo_path, with_diffs=False)
+    except (json.JSONDecodeError, FileNotFoundError, KeyError, TypeError) as e:
+        # TypeError and KeyError come from commits that are not objects with a sha1
         print(f"Error reading JSON files in {repo_path}: {e}")
-        return
-
-    if not isinstance(refactorings, list):
-        print(f"Unexpected format in refactorings.json in {repo_path}")
-        return
-
-    refactoring_commits = refactorings
+        return None
+    return commits, refactorings
+
+def compute_metrics(commits, refactoring_commits, index, blame, repo_name, done=()):
+    """
+    COMM-OWN metrics of the files of every refactoring commit
+    Input: commits: list of commit entries, from load_inputs
+           refactoring_commits: list of the hashes of refactorings.json, from load_inputs
+           index: PathIndex of the history of the repository
+           blame: BlameCache of the repository
+           repo_name: str
+           done: set of str, refactoring commits whose metrics were saved by an earlier run
+    Output: list of dict
+    """
     results = []
 
-    for refactoring_commit in refactoring_commits:
-        for commit in commits:
-            if refactoring_commit['sha1'] == commit['commit_hash']:
-                files = list(commit['diff'].keys())
-
-                if commits.index(commit) == 0:
-                    repo = Repository(os.path.join(GIT_ROOT, repo_name),
-                                   to_commit=commit['commit_hash']).traverse_commits()
-                else:
-                    prev_commit = refactoring_commits[refactoring_commits.index(refactoring_commit) - 1]
-                    repo = Repository(os.path.join(GIT_ROOT, repo_name), 
-                                   from_commit=prev_commit['sha1'],
-                                   to_commit=commit['commit_hash']).traverse_commits()
-                for file in files:
-                    try:
-                        metrics = get_metrics(commit, refactoring_commits, file, repo, os.path.join(GIT_ROOT, repo_name))
-                    except Exception as e:
-                        print(f"Error getting metrics for {file} in {repo_name}: {e}")
-                        continue
-                    if metrics is not None:
-                        results.append({
-                            'commit': commit['commit_hash'],
-                            'metrics': metrics
-                        })
-        if refactoring_commits.index(refactoring_commit) % 10 == 0:
-            print(f"Processed {refactoring_commits.index(refactoring_commit) + 1}/{len(refactoring_commits)} refactorings in {repo_name}")
+    # Position of every collected commit, instead of scanning the list for each refactoring
+    commit_positions = {}
+    for position, commit in enumerate(commits):
+        commit_positions.setdefault(commit['commit_hash'], position)
+
+    for i, refactoring_hash in enumerate(refactoring_commits):
+        position = commit_positions.get(refactoring_hash)
+        if position is not None and refactoring_hash not in done:
+            commit = commits[position]
+            files = list(commit['diff'].keys())
+
+            # The window goes from this commit to the refactoring commit before it in refactorings.json
+            # (or from the first commit to this one). The list is newest first, so that commit is
+            # usually the newer one: the window spans the two commits whichever comes first, as
+            # pydriller's from_commit and to_commit did
+            end = index.position(commit['commit_hash'])
+            start = 0 if position == 0 else index.position(refactoring_commits[i - 1])
+            if start is None or end is None:
+                print(f"Commit {commit['commit_hash']} or its previous refactoring commit is not in the history of {repo_name}")
+                files = []
+            for file in files:
+                try:
+                    metrics = get_metrics(commit, file, index, start, end, blame)
+                except Exception as e:
+                    print(f"Error getting metrics for {file} in {repo_name}: {e}")
+                    continue
+                if metrics is not None:
+                    results.append({
+                        'commit': commit['commit_hash'],
+                        'metrics': metrics
+                    })
+        if i % 10 == 0:
+            print(f"Processed {i + 1}/{len(refactoring_commits)} refactorings in {repo_name}")
 
     print(f"Processed all refactorings in {repo_name}")
+    return results
+
+def load_results(repo_path, repo_name):
+    """
+    Metrics saved by an earlier run, that an incremental run appends to
+    Input: repo_path: str, repo_name: str
+    Output: list of dict, empty when there are none
+    """
+    metrics_file_path = os.path.join(repo_path, f"{repo_name}_metrics.json")
+    if not INCREMENTAL or not os.path.exists(metrics_file_path):
+        return []
+    try:
+        with open(metrics_file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Recomputing the metrics of {repo_name}, {metrics_file_path} cannot be read: {e}")
+        return []
 
+def save_results(results, repo_path, repo_name):
     try:
         metrics_file_path = os.path.join(repo_path, f"{repo_name}_metrics.json")
         with open(metrics_file_path, 'w', encoding='utf-8') as f:
@@ -192,6 +162,69 @@ def process_repository(repo_path, repo_name):
     except Exception as e:
         print(f"Error writing metrics file for {repo_name}: {e}")
 
+class CommOwnMetrics:
+    """COMM-OWN family of a repository, computed by metrics-minor-sexp/fused_metrics.py."""
+
+    def __init__(self, repo_path, repo_name, blame, catalog):
+        """
+        Input: repo_path: str, project folder with commits.json and refactorings.json
+               repo_name: str
+               blame: BlameCache of the repository
+               catalog: CommitCatalog of the repository
+        """
+        self.repo_path = repo_path
+        self.repo_name = repo_name
+        self.blame = blame
+        # Read from the catalog like process_repository does: the windows need the topological
+        # positions of the catalog, and the shared traversal comes in git log's default order,
+        # which differs from them as soon as the history has merges
+        self.index = PathIndex.from_catalog(catalog)
+
+    def process_commit(self, commit, ids):
+        # The index already holds the whole history
+        pass
+
+    def state(self):
+        return {}
+
+    def restore(self, state):
+        pass
+
+    def finish(self):
+        inputs = load_inputs(self.repo_path)
+        if inputs is None:
+            return None
+        commits, refactorings = inputs
+        earlier = load_results(self.repo_path, self.repo_name)
+        done = {result['commit'] for result in earlier}
+        return earlier + compute_metrics(commits, refactorings, self.index, self.blame, self.repo_name, done)
+
+    def output_file(self, project_path):
+        # Written next to its inputs, like process_repository does
+        return os.path.join(self.repo_path, f"{self.repo_name}_metrics.json")
+
+def process_repository(repo_path, repo_name):
+    inputs = load_inputs(repo_path)
+    if inputs is None:
+        return
+    commits, refactorings = inputs
+    git_path = os.path.join(GIT_ROOT, repo_name)
+
+    # Paths, line counts and authors of the whole history, from the catalog of the
+    # repository (built on the first run, then shared with the other scripts)
+    catalog = open_catalog(git_path, catalog_path(repo_path), os.path.join(repo_path, 'refactorings.json'))
+    index = PathIndex.from_catalog(catalog)
+    catalog.close()
+    # Blames are cached by file content, in a file shared with calc_1b_metrics.py (MINOR)
+    blame = BlameCache(git_path, cache_file(repo_path))
+
+    # In incremental mode only the refactoring commits without saved metrics are computed
+    earlier = load_results(repo_path, repo_name)
+    done = {result['commit'] for result in earlier}
+    results = earlier + compute_metrics(commits, refactorings, index, blame, repo_name, done)
+    blame.close()
+    save_results(results, repo_path, repo_name)
+
 def main():
     base_path = BASE_PATH
     for repo_name in os.listdir(base_path):
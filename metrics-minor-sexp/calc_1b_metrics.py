@@ -1,91 +1,224 @@
+from array import array
+from bisect import bisect_right, insort
 from collections import defaultdict
 import math
-import os, subprocess, time
-from pydriller import Repository
+import os, sys, time
 from scipy.stats.mstats import gmean
 
 from clean_refactoring_output import create_only_refactorings_file, load_commits
-from calc_2_metrics import collect_process_settings, is_a_refactoring_commit, save_metrics
-
-def process_repo(repository_path, refactorings_file_path):
-    commit_metrics = []
-
-
-    # Structure: {file_path: [{developer: count}]}
-    dev_commit_count_per_file = {}
-
-    # Structure: {file_path: {developers :{developer1: [commit_date1, commit_date2, ...],
-    #                                      developer2: [commit_date1, commit_date2, ...]},
-    #             creation_date: datetime,
-    #             last_refactor_date: datetime},
-    #                       } 
-    dev_commit_per_file = {}
-    
-    all_commits = [c for c in Repository(path_to_repo=repository_path).traverse_commits()]
-    total_commits = len(all_commits)
-    repository = Repository(path_to_repo=repository_path).traverse_commits() 
-
-    EXP = calculate_exp(repository_path)      
-    print(f"EXP: {EXP}")
+from calc_2_metrics import collect_process_settings, load_catalog, save_metrics
+
+# The shared helpers live at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from git_log_parser import iter_log
+from blame_cache import BlameCache, cache_file
+from file_ids import FileIds
+from checkpoints import Checkpointer, checkpoint_path
+from refactoring_index import RefactoringIndex
+
+class AuthorCommitCounts:
+    """
+    Author names interned to integer IDs, with the number of commits of every author up to
+    the current commit of the traversal, for OEXP.
+    """
+
+    def __init__(self):
+        self.ids = {}                       # author name -> ID
+        self.total = 0
+        self.per_author = array('l')        # ID -> number of commits
+
+    def add(self, author):
+        # Counts a commit of the author, and returns the ID of the author
+        author_id = self.ids.get(author)
+        if author_id is None:
+            author_id = self.ids[author] = len(self.per_author)
+            self.per_author.append(0)
+        self.total += 1
+        self.per_author[author_id] += 1
+        return author_id
+
+    def share(self, author_id):
+        # Percentage of the commits so far (the current one included) made by the author
+        return self.per_author[author_id] * 100 / self.total if self.total else 0
+
+class FileActivity:
+    """
+    Commits of a file: their timestamps, and the number of commits and latest commit of each
+    of its developers (by author ID), for NADEV, NDDEV, NCOMM and OEXP.
+    """
+    __slots__ = ('timestamps', 'developers', 'commit_counts', 'last_commit', 'creation_date', 'last_refactor_date')
+
+    def __init__(self, timestamp):
+        self.timestamps = array('q')    # epoch seconds of the commits of the file, sorted
+        self.developers = {}            # author ID -> index in commit_counts and last_commit, in order of arrival
+        self.commit_counts = array('l')
+        self.last_commit = array('q')   # epoch seconds of the latest commit of the developer
+        self.creation_date = timestamp
+        self.last_refactor_date = timestamp
+
+    def add(self, author_id, timestamp):
+        # The commits come nearly in date order, so this is an append most of the time
+        insort(self.timestamps, timestamp)
+        index = self.developers.get(author_id)
+        if index is None:
+            self.developers[author_id] = len(self.commit_counts)
+            self.commit_counts.append(1)
+            self.last_commit.append(timestamp)
+        else:
+            self.commit_counts[index] += 1
+            if timestamp > self.last_commit[index]:
+                self.last_commit[index] = timestamp
+
+    def latest_commits(self):
+        return zip(self.developers, self.last_commit)
+
+    def highest_contributor(self):
+        # Author ID with the most commits on the file, the first one to arrive on a tie
+        best = max(range(len(self.commit_counts)), key=self.commit_counts.__getitem__)
+        return list(self.developers)[best]
+
+    def since(self, timestamp):
+        return self.timestamps[bisect_right(self.timestamps, timestamp):]
+
+def commit_activity(activities, since):
+    """
+    Activity of the files co-modified by a refactoring commit, queried for each of its files
+    Input: activities: list of FileActivity, the modified (MODIFY) files of the commit
+           since: int, epoch seconds, no NCOMM query of the commit goes further back
+    Output: (sorted latest commit timestamp of every developer over the files,
+             sorted commit timestamps after since common to all the files)
+    """
+    last_commit = {}
+    for activity in activities:
+        for developer, timestamp in activity.latest_commits():
+            if timestamp > last_commit.get(developer, timestamp - 1):
+                last_commit[developer] = timestamp
+    common = set()
+    if activities:
+        common = set(activities[0].since(since)).intersection(*(activity.since(since) for activity in activities[1:]))
+    return sorted(last_commit.values()), sorted(common)
+
+def count_after(timestamps, timestamp):
+    # Number of values of a sorted list greater than timestamp
+    return len(timestamps) - bisect_right(timestamps, timestamp)
+
+class MinorExpMetrics:
+    """MINOR-EXP family (MINOR, NADEV, NDDEV, NCOMM, OEXP) of a repository, fed one commit at a time."""
+
+    def __init__(self, repository_path, refactorings, catalog, blame):
+        """
+        Input: repository_path: str
+               refactorings: RefactoringIndex of the repository
+               catalog: CommitCatalog of the repository, only read here
+               blame: BlameCache of the repository
+        """
+        self.repository_path = repository_path
+        self.refactorings = refactorings
+        self.blame = blame
+        self.commit_metrics = []
+
+        # Structure: [FileActivity] indexed by file ID (IDs are given in order, from 0), with
+        # the sorted commit timestamps of the file, the commit count and latest commit of every
+        # developer, its creation date and last refactor date
+        self.file_activity = []
+
+        # Author IDs, and commits of every author up to the current commit, counted along the traversal
+        self.author_counts = AuthorCommitCounts()
+
+        self.EXP = calculate_exp(repository_path, catalog.authors())
+        print(f"EXP: {self.EXP}")
+
+    def process_commit(self, commit, ids):
+        # ids: file IDs of the modified files of the commit (see file_ids.py)
+        commit_process_output = process_commit(commit,
+                                               ids,
+                                               self.refactorings,
+                                               self.author_counts,
+                                               self.file_activity,
+                                               self.blame)
+        if commit_process_output:
+            self.commit_metrics.append(commit_process_output)
+
+    def state(self):
+        # What a checkpoint keeps, the rest is rebuilt from the catalog
+        return {"commit_metrics": self.commit_metrics,
+                "file_activity": self.file_activity,
+                "author_counts": self.author_counts}
+
+    def restore(self, state):
+        self.commit_metrics = state["commit_metrics"]
+        self.file_activity = state["file_activity"]
+        self.author_counts = state["author_counts"]
+
+    def finish(self):
+        return {
+            "repository": self.repository_path.split(os.sep)[-1],
+            "commit_metrics": self.commit_metrics,
+            "EXP": self.EXP
+        }
+
+    def output_file(self, project_path):
+        project_name = self.repository_path.split(os.sep)[-1]
+        return os.path.join(project_path, f"{project_name}-part_1b_metrics.json")
+
+
+def process_repo(repository_path, refactorings_file_path, refactorings=None):
+    # The number of commits, their authors and the refactoring commits (unless a RefactoringIndex
+    # is given) come from the commit catalog
+    catalog = load_catalog(repository_path, refactorings_file_path)
+    total_commits = catalog.count()
+    if refactorings is None:
+        refactorings = RefactoringIndex.from_catalog(catalog)
+    # Blames are cached by file content, in a file shared with metrics-comm-own.py (OWN)
+    blame = BlameCache(repository_path, cache_file(os.path.dirname(refactorings_file_path)))
+    family = MinorExpMetrics(repository_path, refactorings, catalog, blame)
+    catalog.close()
+
+    # Files are keyed by their file ID, which follows renames
+    file_ids = FileIds()
+    # A run that was stopped goes on from its last checkpoint, an incremental run from the end of the last one
+    checkpointer = Checkpointer(checkpoint_path(os.path.dirname(refactorings_file_path), 'part_1b'))
+    state = checkpointer.load()
+    if state is not None:
+        file_ids = state["file_ids"]
+        family.restore(state["family"])
+    # Only paths, authors and dates of the commits are needed, which git log gives without pydriller
+    repository = iter_log(repository_path, rev=checkpointer.revisions(repository_path))
+    get_state = lambda: {"file_ids": file_ids, "family": family.state()}
     
     if not total_commits == 0:
-        for i, commit in enumerate(repository):
+        for i, commit in checkpointer.skip(repository):
             progress = (i+1)/total_commits*100
             if i == 0 or (total_commits >= 4 and (i+1) % (total_commits // 4) == 0) or (i+1) == total_commits:
                 print(f"Processing commit {i+1}/{total_commits} ({progress:.2f}%)")
-            commit_process_output = process_commit(commit,                                                   
-                                                   refactorings_file_path,
-                                                   repository_path,
-                                                   dev_commit_count_per_file,
-                                                   dev_commit_per_file)                
-            if commit_process_output:             
-                commit_metrics.append(commit_process_output) 
-
-    metrics = {
-        "repository": repository_path.split(os.sep)[-1],
-        "commit_metrics": commit_metrics,
-        "EXP":EXP
-    }
-    return metrics    
+            family.process_commit(commit, file_ids.commit_ids(commit))
+            checkpointer.step(i, commit.hash, get_state)
+    blame.close()
+    checkpointer.finish(get_state)
+
+    return family.finish()
 
 
 def process_commit(commit,                                     
-                   refactorings_file_path,
-                   repository_path,
-                   dev_commit_count_per_file,
-                   dev_commit_per_file):
+                   ids,
+                   refactorings,
+                   author_counts,
+                   file_activity,
+                   blame):
     
-    for mod in commit.modified_files:
-        # If a file was moved, we need to update the dev_commit_count_per_file dictionary
-        if mod.old_path in dev_commit_count_per_file and mod.new_path != mod.old_path:
-            dev_commit_count_per_file[mod.new_path] = dev_commit_count_per_file[mod.old_path]
-            del dev_commit_count_per_file[mod.old_path]
-        # If a file was added, we need to add it to the dev_commit_count_per_file dictionary
-        if mod.new_path not in dev_commit_count_per_file:
-            dev_commit_count_per_file[mod.new_path] = {}
-        if commit.author.name not in dev_commit_count_per_file[mod.new_path]:
-            dev_commit_count_per_file[mod.new_path][commit.author.name] = 0
-        dev_commit_count_per_file[mod.new_path][commit.author.name] += 1
-
-        # If a file was moved, we need to update the dev_commit_per_file dictionary
-        if mod.old_path in dev_commit_per_file and mod.new_path != mod.old_path:
-            dev_commit_per_file[mod.new_path] = dev_commit_per_file[mod.old_path]
-            del dev_commit_per_file[mod.old_path]
-        # If a file was added, we need to add it to the dev_commit_per_file dictionary
-        if mod.new_path not in dev_commit_per_file:
-            dev_commit_per_file[mod.new_path] = {"developers": {}}
-        if commit.author.name not in dev_commit_per_file[mod.new_path]["developers"].keys():
-            dev_commit_per_file[mod.new_path]["developers"][commit.author.name] = []
-        dev_commit_per_file[mod.new_path]["developers"][commit.author.name].append(commit.committer_date)
-        # If the file was created, we need to add the creation date to the dev_commit_per_file dictionary
-        if 'creation_date' not in dev_commit_per_file[mod.new_path].keys(): # mod.change_type.name == 'ADD' and 
-            dev_commit_per_file[mod.new_path]['creation_date'] = commit.committer_date
-        # If the last refactor date is not set, we need to set it to the commit date
-        if 'last_refactor_date' not in dev_commit_per_file[mod.new_path].keys():
-            dev_commit_per_file[mod.new_path]['last_refactor_date'] = commit.committer_date
+    author_id = author_counts.add(commit.author.name)
+    timestamp = int(commit.committer_date.timestamp())
+
+    # A moved file keeps its ID, so its entries do not have to be moved
+    for mod, file_id in zip(commit.modified_files, ids):
+        # If a file was added, we need to add it to file_activity,
+        # its creation date and last refactor date are the date of this commit
+        if file_id == len(file_activity):
+            file_activity.append(FileActivity(timestamp))
+        file_activity[file_id].add(author_id, timestamp)
 
     
-    if not is_a_refactoring_commit(commit.hash, refactorings_file_path):        
+    if commit.hash not in refactorings:        
         return    
     
     modified_files = commit.modified_files   
@@ -100,14 +233,22 @@ def process_commit(commit,
         "OEXP": {},
     }
 
+    # The developers and commits of the co-modified files are gathered once for the whole commit,
+    # each file then only queries them from its own last refactor and creation dates
+    files_to_match = [file_activity[mod_id] for mod, mod_id in zip(modified_files, ids) if mod.change_type.name == 'MODIFY']
+    since = min((file_activity[file_id].last_refactor_date for file, file_id in zip(modified_files, ids) if file.new_path), default=timestamp)
+    activity = commit_activity(files_to_match, since)
+
     try:
-        for cpt, file in enumerate(modified_files):
+        for file, file_id in zip(modified_files, ids):
             process_file(file, 
+                        file_id,
+                        activity,
                         commit,                        
                         current_commit_metrics,
-                        repository_path,
-                        dev_commit_count_per_file,
-                        dev_commit_per_file)
+                        author_counts,
+                        file_activity,
+                        blame)
     except (OSError, ValueError) as e:
         print(f"Error processing commit {commit.hash}: {e}")
     
@@ -115,87 +256,50 @@ def process_commit(commit,
     return current_commit_metrics
 
 def process_file(file, 
+                 file_id,
+                 activity,
                  current_commit,                  
                  commit_metrics,
-                 repo_path,
-                 dev_commit_count_per_file,
-                 dev_commit_per_file):
-    
-    contributors = {}
+                 author_counts,
+                 file_activity,
+                 blame):
     
     ## MINOR ##
     if file.new_path: 
-        git_blame_cmd = ['git', 'blame', f'{current_commit.hash}'.strip(), os.path.normpath(file.new_path)] 
-        blame_result = subprocess.run(git_blame_cmd, capture_output=True, text=True, cwd=repo_path, errors='ignore')
-
-        lines = blame_result.stdout.split('\n')
-        for line in lines: 
-            if line: 
-                try: author = line.split(' ')[1]
-                except IndexError as e: continue
-                if author not in contributors: 
-                    contributors[author] = 0 
-                contributors[author] += 1 
+        # Lines of every author, the blob of the file is known from the log so unchanged files are not blamed again
+        contributors = blame.author_lines(current_commit.hash, file.new_path, file.new_blob)
         total_lines = sum(contributors.values()) 
         minor_contributors = [author for author, lines in contributors.items() if (lines / total_lines) < 0.05]
         commit_metrics["MINOR"][file.new_path] = len(minor_contributors)
 
-        ## NADEV ##
-        active_devs_since_last_refactor = set()
-        files_to_match = [mod.new_path for mod in current_commit.modified_files if mod.change_type.name == 'MODIFY']
-        for file_to_match in files_to_match:
-            if file_to_match in dev_commit_per_file.keys():
-                for dev, commit_dates in dev_commit_per_file[file_to_match]["developers"].items():
-                    if any(commit_date > dev_commit_per_file[file.new_path]["last_refactor_date"] for commit_date in commit_dates):
-                        active_devs_since_last_refactor.add(dev)
-        commit_metrics["NADEV"][file.new_path] = len(active_devs_since_last_refactor)
-
-        ## NDDEV ##
-        active_devs_since_file_creation = set()
-        for file_to_match in files_to_match:
-            if file_to_match in dev_commit_per_file.keys():
-                for dev, commit_dates in dev_commit_per_file[file_to_match]["developers"].items():
-                    if any(commit_date > dev_commit_per_file[file.new_path]["creation_date"] for commit_date in commit_dates):
-                        active_devs_since_file_creation.add(dev)
-        commit_metrics["NDDEV"][file.new_path] = len(active_devs_since_file_creation)
-
-        ## NCOMM ##
-        updated_commit_dates_files = {}
-        for file_to_match in files_to_match:
-            updated_commit_dates_files[file_to_match] = []
-            for commit_dates in dev_commit_per_file[file_to_match]["developers"].values():
-                updated_commit_dates_files[file_to_match].extend([date for date in commit_dates if date > dev_commit_per_file[file.new_path]["last_refactor_date"]])
-
-        if updated_commit_dates_files:
-            intersection = lambda *lists: list(set(lists[0]).intersection(*lists[1:])) if lists else []
-            NCOMM = len(intersection(*updated_commit_dates_files.values()))
-        else:
-            NCOMM = 0
-        commit_metrics["NCOMM"][file.new_path] = NCOMM
+        last_commits, common_commits = activity
+        current_file = file_activity[file_id]
+
+        ## NADEV ## Developers of the co-modified files with a commit since the last refactoring of the file
+        commit_metrics["NADEV"][file.new_path] = count_after(last_commits, current_file.last_refactor_date)
+
+        ## NDDEV ## Developers of the co-modified files with a commit since the creation of the file
+        commit_metrics["NDDEV"][file.new_path] = count_after(last_commits, current_file.creation_date)
+
+        ## NCOMM ## Commits of all the co-modified files since the last refactoring of the file
+        commit_metrics["NCOMM"][file.new_path] = count_after(common_commits, current_file.last_refactor_date)
 
         ## OEXP ##
-        highest_contributor = max(dev_commit_count_per_file[file.new_path], key=dev_commit_count_per_file[file.new_path].get)
-        command = f'git log --pretty=format:"%H %an" | grep "{highest_contributor}" | grep -B 1000000 "{current_commit.hash}" | wc -l'#['git', 'log', '--pretty=format:%H %an', '|', 'grep', highest_contributor, '|', 'grep', '-B', '1000000', current_commit.hash, '|', 'wc', '-l']
-        owner_total_contributions = subprocess.run(command, capture_output=True, text=True, cwd=repo_path, shell=True).stdout.strip()
-        owner_total_contributions = 0 if owner_total_contributions == '' else int(owner_total_contributions)
-        
-        command = f'git log --pretty=format:"%H" | grep -B 1000000 "{current_commit.hash}" | wc -l'
-        total_contributions = subprocess.run(command, capture_output=True, text=True, cwd=repo_path, shell=True).stdout.strip()
-        if total_contributions == '':
-            OEXP = 0
-        else:
-            OEXP = owner_total_contributions*100 / int(total_contributions) 
+        highest_contributor = current_file.highest_contributor()
+        # Share of the commits up to this one made by the highest contributor of the file,
+        # out of the counts kept along the traversal instead of two git log pipelines per file
+        OEXP = author_counts.share(highest_contributor)
         commit_metrics["OEXP"][file.new_path] = OEXP
 
-        dev_commit_per_file[file.new_path]["last_refactor_date"] = current_commit.committer_date 
+        current_file.last_refactor_date = int(current_commit.committer_date.timestamp())
         
 
-def commits_since_last_refactoring(commit, all_commits):
+def commits_since_last_refactoring(commit, all_commits, refactorings):
     commit_index = [c.hash for c in all_commits].index(commit.hash)
     found_commits = [all_commits[commit_index]]
     for c in all_commits[commit_index::-1]:
         found_commits.insert(0, c)
-        if is_a_refactoring_commit(c.hash,""):
+        if c.hash in refactorings:
             break        
     return found_commits
 
@@ -208,9 +312,9 @@ def commits_since_file_creation(commit, all_commits, file_path):
             break
     return found_commits
 
-def calculate_exp(repo_path):
-    result = subprocess.run(['git', 'log', '--pretty=format:%an'], cwd=repo_path, stdout=subprocess.PIPE)
-    authors = result.stdout.decode('utf-8').split('\n')
+def calculate_exp(repo_path, authors=None):
+    if authors is None:
+        authors = [commit.author.name for commit in iter_log(repo_path, files=False)]
     # Count modifications per author
     modifications = defaultdict(int)
     for author in authors:
@@ -226,9 +330,6 @@ def full_repo_analysis_bu(repository_path, refactorings_file_path, project_path)
     save_metrics(metrics, os.path.join(project_path, f"{project_name}-part_1b_metrics.json"))
     print(f"Metrics saved to {os.path.join(project_path, f'{project_name}-part_1b_metrics.json')}")
 
-    if hasattr(is_a_refactoring_commit, 'list_of_commits'):
-        delattr(is_a_refactoring_commit, 'list_of_commits')
-
 
 
 def main():    
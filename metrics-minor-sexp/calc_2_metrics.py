@@ -1,90 +1,242 @@
-import json, os, re, math
-from pydriller import Repository
+import json, os, re, math, sys
+from array import array
+from bisect import bisect_right, insort
 from clean_refactoring_output import load_commits, create_only_refactorings_file
 from collections import defaultdict
-
-def analyze_repository(repository_path, refactorings_file_path):
+from functools import lru_cache
+
+try:
+    import numpy as np # Batch computation of the commit-level metrics
+except ImportError:
+    np = None
+
+# The shared helpers live at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from commit_catalog import catalog_path, open_catalog
+from file_ids import FileIds
+from git_log_parser import iter_log
+from blob_lines import BlobLines
+from checkpoints import Checkpointer, checkpoint_path
+from refactoring_index import RefactoringIndex
+
+# REXP counts the commits of the last month: (date - commit date).days <= 30
+RECENT_SECONDS = 31 * 24 * 3600
+# FIX: a fix keyword in the message. It may be followed by an issue key (e.g. JIRA-123),
+# which does not change whether the message matches.
+FIX_PATTERN = re.compile(r'(?i)\b(?:fix(?:ed|es)?|bug(?:fix)?|patch|resolve[sd]?)\b')
+
+class FilePackageData:
+    """
+    Commits of every file and files of every package. Files are keyed by their file ID,
+    so a file renamed or moved to another package keeps its commits.
+    The counts CEXP, REXP and SEXP are read from are kept up to date as commits are added,
+    instead of scanning the commits of the file or of its whole package for every file.
+    """
+    def __init__(self):
+        self.commits = {}               # file ID -> {commit hash: author}
+        self.dates = {}                 # file ID -> {author: sorted committer timestamps of their commits}
+        self.package = {}               # file ID -> package of the file
+        self.files = defaultdict(set)   # package -> file IDs
+        # package -> {author: {commit hash: number of files of the package it is a commit of}}
+        self.package_commits = {}
+
+    def _count(self, package, commits, step):
+        # Add (step 1) or remove (step -1) commits of a file to the counts of its package
+        authors = self.package_commits.setdefault(package, {})
+        for commit_hash, author in commits.items():
+            counts = authors.setdefault(author, {})
+            count = counts.get(commit_hash, 0) + step
+            if count:
+                counts[commit_hash] = count
+            else:
+                del counts[commit_hash]
+
+    def add_commit(self, file_id, commit_hash, author, date):
+        commits = self.commits.setdefault(file_id, {})
+        if commit_hash in commits:
+            return
+        commits[commit_hash] = author
+        insort(self.dates.setdefault(file_id, {}).setdefault(author, array('q')), int(date.timestamp()))
+        if file_id in self.package:
+            self._count(self.package[file_id], {commit_hash: author}, 1)
+
+    def clear_commits(self, file_id):
+        commits = self.commits.pop(file_id, None)
+        self.dates.pop(file_id, None)
+        if commits and file_id in self.package:
+            self._count(self.package[file_id], commits, -1)
+
+    def set_package(self, file_id, package):
+        old_package = self.package.get(file_id)
+        if old_package == package:
+            return
+        commits = self.commits.get(file_id, {})
+        if old_package is not None:
+            self.files[old_package].discard(file_id)
+            self._count(old_package, commits, -1)
+        if package is None:
+            del self.package[file_id]
+        else:
+            self.package[file_id] = package
+            self.files[package].add(file_id)
+            self._count(package, commits, 1)
+
+    def author_commits(self, file_id, author):
+        # Commits of the author on the file
+        return len(self.dates.get(file_id, {}).get(author, ()))
+
+    def recent_author_commits(self, file_id, author, date):
+        # Commits of the author on the file less than RECENT_SECONDS before date (or after it)
+        timestamps = self.dates.get(file_id, {}).get(author, ())
+        return len(timestamps) - bisect_right(timestamps, int(date.timestamp()) - RECENT_SECONDS)
+
+    def developers(self, file_id):
+        return len(self.dates.get(file_id, {}))
+
+    def package_author_commits(self, package, author):
+        # Distinct commits of the author on the files of the package
+        return len(self.package_commits.get(package, {}).get(author, {}))
+
+class NdSexpMetrics:
+    """ND-SEXP family (NF, ENTROPY, ND, NS, LA, LD, LT, NDEV, FIX, AGE, NUC, CEXP, REXP, SEXP) of a repository, fed one commit at a time."""
+
+    def __init__(self, repository_path, refactorings, catalog):
+        """
+        Input: repository_path: str
+               refactorings: RefactoringIndex of the repository
+               catalog: CommitCatalog of the repository, only read here
+        """
+        self.repository_path = repository_path
+        self.refactorings = refactorings
+        self.commit_metrics = []
+        self.last_modification_for_file = {}
+        self.file_pkg_data = FilePackageData()
+        # Dictionary to store the commit dates, out of the commit catalog
+        self.commit_dates_modifs = catalog.committer_dates()
+        # NF, ENTROPY, FIX, ND, NS, LA and LD of all the refactoring commits, computed at once
+        self.commit_level = commit_level_metrics(catalog)
+        # LT is read from the blobs the files had before the commit
+        self.blob_lines = BlobLines(repository_path)
+
+    def process_commit(self, commit, ids):
+        # ids: file IDs of the modified files of the commit (see file_ids.py)
+        commit_process_output = process_commit(commit,
+                                               ids,
+                                               self.last_modification_for_file,
+                                               self.file_pkg_data,
+                                               self.refactorings,
+                                               self.commit_dates_modifs,
+                                               self.blob_lines,
+                                               self.commit_level)
+        if commit_process_output:
+            self.commit_metrics.append(commit_process_output)
+
+    def state(self):
+        # What a checkpoint keeps, the rest is rebuilt from the catalog
+        return {"commit_metrics": self.commit_metrics,
+                "last_modification_for_file": self.last_modification_for_file,
+                "file_pkg_data": self.file_pkg_data}
+
+    def restore(self, state):
+        self.commit_metrics = state["commit_metrics"]
+        self.last_modification_for_file = state["last_modification_for_file"]
+        self.file_pkg_data = state["file_pkg_data"]
+
+    def finish(self):
+        self.blob_lines.close()
+        return {
+            "repository": self.repository_path.split(os.sep)[-1],
+            "commit_metrics": self.commit_metrics
+        }
+
+    def output_file(self, project_path):
+        project_name = self.repository_path.split(os.sep)[-1]
+        return os.path.join(project_path, f"{project_name}-part_2_metrics.json")
+
+def analyze_repository(repository_path, refactorings_file_path, refactorings=None):
     """
     Analyze a repository and extract the metrics for each commit
     Input: repository_path: str
            refactorings_file_path: str
+           refactorings: RefactoringIndex or None, read from the commit catalog when not given
     Output: dict
     """ 
-    commit_metrics = []    
-    last_modification_for_file = {}
-    file_pkg_data = defaultdict(lambda: defaultdict(dict))
-    
-    # Dictionary to store the commit dates
-    commit_dates_modifs = get_commit_dates(Repository(path_to_repo=repository_path).traverse_commits())
-    total_commits = len(commit_dates_modifs)
-
-    repository = Repository(path_to_repo=repository_path).traverse_commits()  
+    # The commit dates and the refactoring commits come from the commit catalog
+    catalog = load_catalog(repository_path, refactorings_file_path)
+    if refactorings is None:
+        refactorings = RefactoringIndex.from_catalog(catalog)
+    total_commits = catalog.count()
+    family = NdSexpMetrics(repository_path, refactorings, catalog)
+    catalog.close()
+    # Files are keyed by their file ID, which follows renames
+    file_ids = FileIds()
+    # A run that was stopped goes on from its last checkpoint, an incremental run from the end of the last one
+    checkpointer = Checkpointer(checkpoint_path(os.path.dirname(refactorings_file_path), 'part_2'))
+    state = checkpointer.load()
+    if state is not None:
+        file_ids = state["file_ids"]
+        family.restore(state["family"])
+
+    # Paths, line counts and blobs of the modified files come from git log, without pydriller
+    repository = iter_log(repository_path, rev=checkpointer.revisions(repository_path))
+    get_state = lambda: {"file_ids": file_ids, "family": family.state()}
 
     if not total_commits == 0:
-        for i, commit in enumerate(repository):
+        for i, commit in checkpointer.skip(repository):
             progress = (i+1)/total_commits*100
             if i == 0 or (total_commits >= 4 and (i+1) % (total_commits // 4) == 0) or (i+1) == total_commits:
                 print(f"Processing commit {i+1}/{total_commits} ({progress:.2f}%)")
-            commit_process_output = process_commit(commit,                      
-                                                last_modification_for_file, 
-                                                file_pkg_data,
-                                                refactorings_file_path,
-                                                commit_dates_modifs)        
-                
-            if commit_process_output:             
-                commit_metrics.append(commit_process_output)         
-
-    metrics = {
-        "repository": repository_path.split(os.sep)[-1],
-        "commit_metrics": commit_metrics
-    }
-    return metrics
+            family.process_commit(commit, file_ids.commit_ids(commit))
+            checkpointer.step(i, commit.hash, get_state)
+
+    checkpointer.finish(get_state)
+    return family.finish()
 
 def process_commit(commit,                 
+                   ids,
                    last_modification_for_file,
                    file_pkg_data,                   
-                   refactorings_file_path,
-                   commit_dates_modifs):
-
-    directories = set()
-    modified_packages = set()
-    
-    if not is_a_refactoring_commit(commit.hash, refactorings_file_path):
+                   refactorings,
+                   commit_dates_modifs,
+                   blob_lines,
+                   commit_level=None):
+
+    # ids: stable IDs of the modified files, following renames
+    # commit_level: {commit hash: commit-level metrics} from commit_level_metrics
+    if commit.hash not in refactorings:
         # Only add the date of the file modification if it's not a refactoring commit
-        for modified_file in commit.modified_files:
+        for modified_file, file_id in zip(commit.modified_files, ids):
             if modified_file.new_path:
-                last_modification_for_file[modified_file.new_path] = commit.committer_date
+                last_modification_for_file[file_id] = commit.committer_date
                 # Add the file to the file_pkg_data if it's not a deletion
                 new_package = extract_package_name(modified_file.new_path)
+                # The commits of the file start again from this one, or are dropped when the
+                # file is no longer in a package (e.g. no longer a .java file)
+                file_pkg_data.clear_commits(file_id)
                 if new_package:
-                    file_pkg_data[new_package][modified_file.new_path] = {commit.hash: {"committer": commit.author.name, "date": commit.committer_date}}                
+                    file_pkg_data.add_commit(file_id, commit.hash, commit.author.name, commit.committer_date)
+                file_pkg_data.set_package(file_id, new_package)
             else:
                 # remove the file from the last modification dictionary if it was deleted
-                last_modification_for_file.pop(modified_file.old_path, None)
+                last_modification_for_file.pop(file_id, None)
         return    
     
     modified_files = commit.modified_files
 
-    ## NF ## Number of modified files
-    NF = len(modified_files)
-
-    ## ENTROPY ## The distribution of the modified code across each given file in the considered commit
-    ENTROPY = calculate_entropy(modified_files) 
-
-    ## FIX ## Whether or not the change is a defect fix
-    FIX = bool(re.search(r'(?i)\b(?:fix(?:ed|es)?|bug(?:fix)?|patch|resolve[sd]?)\b(?:.*\b[A-Z]+-\d+\b)?', commit.msg))
+    # The metrics that only depend on the commit itself come from the batch when it was computed
+    level = (commit_level or {}).get(commit.hash) or single_commit_level_metrics(commit)
 
     current_commit_metrics = {
         "commit": commit.hash,
-        "NF": NF,
-        "ENTROPY": ENTROPY,
-        "ND": -1,
-        "NS": -1,
-        "LA": {},
-        "LD": {},
+        "NF": level["NF"],
+        "ENTROPY": level["ENTROPY"],
+        "ND": level["ND"],
+        "NS": level["NS"],
+        "LA": level["LA"],
+        "LD": level["LD"],
         "LT": {},
         "NDEV": {},
-        "FIX": FIX,
+        "FIX": level["FIX"],
         "AGE": {},
         "NUC": {},
         "CEXP": {},
@@ -92,12 +244,15 @@ def process_commit(commit,
         "SEXP": {},
     }    
 
+    # LT of all the files of the commit, from the line counts of their blobs before the commit
+    lines_before = blob_lines.line_counts([file.old_blob if file.new_path else None for file in modified_files])
+
     try:
-        for file in modified_files:       
+        for file, file_id, file_lines_before in zip(modified_files, ids, lines_before):
             process_file(file, 
+                        file_id,
+                        file_lines_before,
                         commit,
-                        directories, 
-                        modified_packages, 
                         current_commit_metrics,                                                                                                                             
                         last_modification_for_file, 
                         commit_dates_modifs, 
@@ -105,20 +260,147 @@ def process_commit(commit,
     except ValueError as e:
         print(f"Error processing commit {commit.hash}: {e}")
 
-    ## ND ## The number of directories involved in a commit (convert to sets to remove the duplicates)      
-    ND = len(directories)    
-    current_commit_metrics["ND"] = ND
+    return current_commit_metrics
 
-    ## NS ## Number of modified subsystems (convert to sets to remove the duplicates)
-    NS = len(modified_packages)
-    current_commit_metrics["NS"] = NS
+def single_commit_level_metrics(commit):
+    """
+    NF, ENTROPY, FIX, ND, NS, LA and LD of one commit, when they are not computed in batch
+    Input: commit: commit of the traversal
+    Output: dict
+    """
+    modified_files = commit.modified_files
+    directories = set()
+    modified_packages = set()
+    LA = {}
+    LD = {}
+    for file in modified_files:
+        # Add the directory of the old and new paths to the set
+        if file.old_path:
+            directories.add(directory_of(file.old_path))
+        if file.new_path:
+            directories.add(directory_of(file.new_path))
+        # Add the old and new packages to the set (only non-null packages)
+        for package in (extract_package_name(file.new_path), extract_package_name(file.old_path)):
+            if package:
+                modified_packages.add(package)
+        if file.new_path:
+            ## LA ## The lines added to the given file in the considered commit 
+            LA[file.new_path] = file.added_lines
+            ## LD ## The number of lines removed from the given file in the considered commit
+            LD[file.new_path] = file.deleted_lines
+
+    return {
+        ## NF ## Number of modified files
+        "NF": len(modified_files),
+        ## ENTROPY ## The distribution of the modified code across each given file in the considered commit
+        "ENTROPY": calculate_entropy(modified_files),
+        ## FIX ## Whether or not the change is a defect fix
+        "FIX": bool(FIX_PATTERN.search(commit.msg)),
+        ## ND ## The number of directories involved in a commit
+        "ND": len(directories),
+        ## NS ## Number of modified subsystems
+        "NS": len(modified_packages),
+        "LA": LA,
+        "LD": LD,
+    }
 
-    return current_commit_metrics
+def commit_level_metrics(catalog):
+    """
+    NF, ENTROPY, FIX, ND, NS, LA and LD of all the refactoring commits of a repository.
+    They need no state of the traversal, so they are computed column-wise over the file
+    changes of the refactoring commits kept in the commit catalog.
+    Input: catalog: CommitCatalog
+    Output: dict {commit hash: metrics, shaped like single_commit_level_metrics}, empty without
+            numpy (the metrics are then computed commit by commit)
+    """
+    if np is None:
+        return {}
+    commits = catalog.refactoring_commits()
+    if not commits:
+        return {}
+    count = len(commits)
+    index = {position: i for i, (position, _, _) in enumerate(commits)}
+    changes = catalog.refactoring_file_changes()
+
+    # One row per file change: the commit it belongs to, its lines, and the directories and
+    # packages of its paths as integer IDs. Paths come back in many commits, so each of them
+    # is only split once.
+    path_ids = {}   # path -> (directory ID, package ID or -1)
+    directory_ids = {}
+    package_ids = {}
+
+    def split(path):
+        directory = directory_ids.setdefault(directory_of(path), len(directory_ids))
+        package = extract_package_name(path)
+        ids = path_ids[path] = (directory, package_ids.setdefault(package, len(package_ids)) if package else -1)
+        return ids
+
+    commit_rows = []
+    directory_commits, directory_rows = [], []
+    package_commits, package_rows = [], []
+    LA = [{} for _ in commits]
+    LD = [{} for _ in commits]
+    for position, old_path, new_path, added_lines, deleted_lines in changes:
+        i = index[position]
+        commit_rows.append(i)
+        for path in (old_path, new_path):
+            if path:
+                directory, package = path_ids.get(path) or split(path)
+                directory_commits.append(i)
+                directory_rows.append(directory)
+                if package >= 0:
+                    package_commits.append(i)
+                    package_rows.append(package)
+        if new_path:
+            LA[i][new_path] = added_lines
+            LD[i][new_path] = deleted_lines
+    commit_of = np.array(commit_rows, dtype=np.int64)
+    added = np.fromiter((change[3] for change in changes), dtype=np.float64, count=len(changes))
+    deleted = np.fromiter((change[4] for change in changes), dtype=np.float64, count=len(changes))
+
+    ## NF ##
+    NF = np.bincount(commit_of, minlength=count)
+    ## ENTROPY ## -sum(p * log2(p)) over the share p of the modified lines of every file
+    lines = added + deleted
+    totals = np.bincount(commit_of, weights=lines, minlength=count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = lines / totals[commit_of]
+    # math.log2 of the distinct shares (np.log2 can differ in the last bit), so the values are
+    # exactly those of calculate_entropy
+    values, inverse = np.unique(shares, return_inverse=True)
+    logs = np.array([math.log2(value) if value > 0 else 0.0 for value in values.tolist()])
+    terms = np.where(shares > 0, shares * logs[inverse], 0.0)
+    ENTROPY = -np.bincount(commit_of, weights=terms, minlength=count)
+    ## ND ## and ## NS ## Distinct (commit, directory) and (commit, package) pairs of every commit
+    ND = distinct_per_commit(directory_commits, directory_rows, len(directory_ids), count)
+    NS = distinct_per_commit(package_commits, package_rows, len(package_ids), count)
+    ## FIX ## One pass of the pattern over all the messages, each match is mapped back to its message
+    messages = [message or '' for _, _, message in commits]
+    starts = np.cumsum([0] + [len(message) + 1 for message in messages[:-1]])
+    matches = np.fromiter((match.start() for match in FIX_PATTERN.finditer('\0'.join(messages))), dtype=np.int64)
+    FIX = np.zeros(count, dtype=bool)
+    FIX[np.searchsorted(starts, matches, side='right') - 1] = True
+
+    return {commit_hash: {
+                "NF": int(NF[i]),
+                # Same value as calculate_entropy, which gives 0 when no line was modified
+                "ENTROPY": float(ENTROPY[i]) if totals[i] else 0,
+                "FIX": bool(FIX[i]),
+                "ND": int(ND[i]),
+                "NS": int(NS[i]),
+                "LA": LA[i],
+                "LD": LD[i],
+            } for i, (_, commit_hash, _) in enumerate(commits)}
+
+def distinct_per_commit(commit_rows, value_rows, size, count):
+    # Number of distinct values of every commit, out of the commit index and value ID of every row
+    keys = np.unique(np.array(commit_rows, dtype=np.int64) * size + np.array(value_rows, dtype=np.int64))
+    return np.bincount(keys // max(size, 1), minlength=count)
 
 def process_file(file, 
+                 file_id,
+                 lines_before,
                  current_commit,
-                 directories, 
-                 modified_packages, 
                  commit_metrics,                                  
                  last_modification_for_file,
                  commit_dates_modifs,
@@ -126,81 +408,44 @@ def process_file(file,
     
     file_name = os.path.basename(file.new_path) if file.new_path else os.path.basename(file.old_path)+ "(deleted)"
      
-    # Add the directory of the old and new paths to the set
-    if file.old_path:
-        directories.add(file.old_path.rsplit('/', 1)[0])
-    if file.new_path:
-        directories.add(file.new_path.rsplit('/', 1)[0])
-
-    # Get the old and new package names
-    old_package = extract_package_name(file.old_path)
+    # Get the new package name
     new_package = extract_package_name(file.new_path)
 
     if new_package:
-        modified_packages.add(new_package)        
-        # Add the package to the file_pkg_data
-        file_pkg_data[new_package][file.new_path][current_commit.hash] = {"committer": current_commit.author.name, "date": current_commit.committer_date}  
-
-    # Add both to the set (only non-null packages)
-    if old_package: 
-        modified_packages.add(old_package)
-
-        if new_package and old_package != new_package:
-           # There has been a package change
-           # Move the commits regarding the file to the new package
-              if old_package in file_pkg_data.keys():
-                    if file.old_path in file_pkg_data[old_package].keys():
-                        file_pkg_data[new_package][file.new_path] = file_pkg_data[old_package].pop(file.old_path)
+        # Add the commit to the file, which keeps its commits when it moves to another package
+        file_pkg_data.add_commit(file_id, current_commit.hash, current_commit.author.name, current_commit.committer_date)
+        file_pkg_data.set_package(file_id, new_package)
     
     if file.new_path:
-        ## LA ## The lines added to the given file in the considered commit 
-        commit_metrics["LA"][file.new_path] = file.added_lines    
-
-        ## LD ## The number of lines removed from the given file in the considered commit
-        commit_metrics["LD"][file.new_path] = file.deleted_lines
-
         ## LT ## The number of lines of code in the given file in the considered commit before the change 
-        commit_metrics["LT"][file.new_path] = len(file.source_code_before.split('\n')) if file.source_code_before else 0
+        commit_metrics["LT"][file.new_path] = lines_before
 
         ## AGE ##The average period between the last and the current change
         # The last modification date is the last time the file was modified before the current commit. If it's the first time, it's the commit date
-        last_modification_date = last_modification_for_file.get(file.new_path, commit_dates_modifs[current_commit.hash])
+        last_modification_date = last_modification_for_file.get(file_id, commit_dates_modifs[current_commit.hash])
         commit_metrics["AGE"][file.new_path] = (commit_dates_modifs[current_commit.hash] - last_modification_date).days
        
         ## NUC ## The number of times the file has been modified up to the considered commit
         NUC = 1
         if new_package:
-            NUC = len(file_pkg_data.get(new_package, {}).get(file.new_path, {})) # Since there is at least one commit (the current one)
+            NUC = len(file_pkg_data.commits.get(file_id, {})) # Since there is at least one commit (the current one)
         commit_metrics["NUC"][file.new_path] = NUC
 
-    
-        developer_set = set()
-        # Count the number of different developers that changed the file
-        for commit in file_pkg_data.get(new_package, {}).get(file.new_path, {}).values():            
-            developer_set.add(commit["committer"])
 
         ## NDEV ## The number of developers that changed the modified
-        commit_metrics["NDEV"][file.new_path] = len(developer_set) or 1 # Since there is at least one developer (that isn't added to the file_pkg_data yet)
-        
+        # Count the number of different developers that changed the file
+        developers = file_pkg_data.developers(file_id) if new_package else 0
+        commit_metrics["NDEV"][file.new_path] = developers or 1 # Since there is at least one developer (that isn't added to the file_pkg_data yet)
+
     CEXP = 1
     REXP = 1
-    for package_files in file_pkg_data.values():        
-        if file.new_path in package_files.keys():
-            for commit in package_files[file.new_path].values():
-                if current_commit.author.name == commit["committer"]:
-                    CEXP += 1
-                    if (current_commit.committer_date - commit["date"]).days <= 30:
-                        REXP += 1
-            break
-
-    commits_done_by_one_dev = set()
+    if file.new_path and file_id in file_pkg_data.package:
+        CEXP += file_pkg_data.author_commits(file_id, current_commit.author.name)
+        REXP += file_pkg_data.recent_author_commits(file_id, current_commit.author.name, current_commit.committer_date)
+
     SEXP = 1
-    if new_package and new_package in file_pkg_data.keys():
-        for file_details in file_pkg_data[new_package].values():
-            for commit_hsh, commit_details in file_details.items():
-                if current_commit.author.name == commit_details["committer"]:
-                    commits_done_by_one_dev.add(commit_hsh)
-        SEXP = len(commits_done_by_one_dev)
+    if new_package:
+        SEXP = file_pkg_data.package_author_commits(new_package, current_commit.author.name)
 
     ## CEXP ## The number of commits performed on the given file by the committer up to the considered commit
     commit_metrics["CEXP"][file.new_path] = CEXP
@@ -209,19 +454,16 @@ def process_file(file,
     ## SEXP ## The number of commits a given developer performs in the considered package containing the given
     commit_metrics["SEXP"][file.new_path] = SEXP   
 
-def is_a_refactoring_commit(commit_hash, refactorings_file_path):
+def load_catalog(repository_path, refactorings_file_path):
     """
-    Check if a commit is a refactoring commit
-    Input: commit_hash: str
-              refactorings_file_path: str
-    Output: bool
+    Open the commit catalog kept next to the refactorings file, building it on the first run
+    Input: repository_path: str
+           refactorings_file_path: str
+    Output: CommitCatalog
     """
-    if not hasattr(is_a_refactoring_commit, "list_of_commits"):
-        refactoring_commits = load_refactoring_commits(refactorings_file_path)
-        is_a_refactoring_commit.list_of_commits = [commit['sha1'] for commit in refactoring_commits]
-    
-    found = commit_hash in is_a_refactoring_commit.list_of_commits
-    return found
+    if not os.path.exists(refactorings_file_path):
+        create_only_refactorings_file(os.path.dirname(refactorings_file_path))
+    return open_catalog(repository_path, catalog_path(os.path.dirname(refactorings_file_path)), refactorings_file_path)
 
 def load_refactoring_commits(refactorings_file_path):
     """
@@ -246,6 +488,12 @@ def calculate_entropy(modified_files):
     entropy = -sum(p * math.log2(p) for p in proportions if p > 0)
     return entropy
 
+def directory_of(file_path):
+    # A path without a directory counts as its own directory
+    return file_path.rsplit('/', 1)[0]
+
+# Paths come back in many commits, so each of them is only split once
+@lru_cache(maxsize=1 << 16)
 def extract_package_name(file_path):
     """
     Given a file path, extract the package name by removing the file name 
@@ -287,9 +535,6 @@ def full_repo_analysis(repository_path, refactorings_file_path, project_path):
     project_name = repository_path.split(os.sep)[-1]
     save_metrics(metrics, os.path.join(project_path, f"{project_name}-part_2_metrics.json"))
 
-    if hasattr(is_a_refactoring_commit, 'list_of_commits'):
-        delattr(is_a_refactoring_commit, 'list_of_commits')
-
 def main():    
     repository_path, refactorings_file_path, project_path  = collect_process_settings()    
     full_repo_analysis(repository_path, refactorings_file_path, project_path)
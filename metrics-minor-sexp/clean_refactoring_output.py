@@ -1,6 +1,10 @@
-import json, os
+import json, os, sys
 from pathlib import Path
 
+# The shared helpers live at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from refactorings_reader import filter_refactorings
+
 def keep_refactorings(commits):
     print(f"Number of initial commits: {len(commits['commits'])}")
     refactorings = [commit for commit in commits["commits"] if commit['refactorings']]
@@ -19,11 +23,13 @@ def create_only_refactorings_file(folder_to_process:str):
     # Take folder_to_process and add the refactrings.json file to it
     input_file = os.path.join(folder_to_process, "refactorings.json")
     output_file = os.path.join(folder_to_process, "only_refactorings.json")
-    if Path(output_file).exists():
+    # Filtered again when refactorings.json gained the refactorings of new commits
+    if Path(output_file).exists() and os.path.getmtime(output_file) >= os.path.getmtime(input_file):
             return output_file
-    commits = load_commits(input_file)
-    refactorings = keep_refactorings(commits)
-    save_refactorings(refactorings, output_file)
+    # Stream refactorings.json instead of loading the whole file in memory
+    total, kept = filter_refactorings(input_file, output_file)
+    print(f"Number of initial commits: {total}")
+    print(f"Number of commits with refactorings: {kept}")
 
     return output_file
 
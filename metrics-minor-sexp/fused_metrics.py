@@ -0,0 +1,139 @@
+# Runs the metric families of a repository over a single traversal of its history.
+# calc_1b_metrics.py (MINOR-EXP), calc_2_metrics.py (ND-SEXP) and metrics-comm-own.py
+# (COMM-OWN) each walk the whole history on their own. Here they are registered as
+# families that receive the same stream of commits, with the file IDs of their modified
+# files, so one traversal of git log per repository produces the three result files.
+#
+# A family is created by a factory taking the RepositoryContext, and has three methods:
+#   process_commit(commit, ids): called for every commit, oldest first
+#   state() and restore(state): what the checkpoints of the traversal keep of the family
+#   finish(): returns the metrics of the repository (None when there is nothing to save)
+#   output_file(project_path): path of the JSON file the metrics are saved to
+
+import importlib.util
+import os, sys
+
+from calc_1b_metrics import MinorExpMetrics
+from calc_2_metrics import NdSexpMetrics, load_catalog, save_metrics, collect_process_settings
+
+# The shared helpers live at the root of the repository
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT_DIR)
+from blame_cache import BlameCache, cache_file
+from file_ids import FileIds
+from git_log_parser import iter_log
+from checkpoints import Checkpointer, checkpoint_path
+from refactoring_index import RefactoringIndex
+
+
+class RepositoryContext:
+    """What the families of a repository share: its paths, commit catalog, refactoring commits and blame cache."""
+
+    def __init__(self, repository_path, refactorings_file_path, refactorings=None):
+        self.repository_path = repository_path
+        self.refactorings_file_path = refactorings_file_path
+        # Folder of refactorings.json, commits.json and the caches of the repository
+        self.project_folder = os.path.dirname(refactorings_file_path)
+        self.project_name = repository_path.split(os.sep)[-1]
+        # Opened for the creation of the families, closed before the traversal
+        self.catalog = load_catalog(repository_path, refactorings_file_path)
+        # Belongs to this repository, so several of them can be analysed in the same process
+        self.refactorings = refactorings if refactorings is not None else RefactoringIndex.from_catalog(self.catalog)
+        # Shared by OWN and MINOR, so a file is blamed once for both
+        self.blame = BlameCache(repository_path, cache_file(self.project_folder))
+
+
+def load_comm_own():
+    # metrics-comm-own.py has a hyphen in its name, so it is loaded by path
+    path = os.path.join(ROOT_DIR, 'metrics-COMM-OWN', 'metrics-comm-own.py')
+    spec = importlib.util.spec_from_file_location('metrics_comm_own', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def comm_own_family(context):
+    comm_own = load_comm_own()
+    return comm_own.CommOwnMetrics(context.project_folder, context.project_name, context.blame, context.catalog)
+
+
+def minor_exp_family(context):
+    return MinorExpMetrics(context.repository_path, context.refactorings, context.catalog, context.blame)
+
+
+def nd_sexp_family(context):
+    return NdSexpMetrics(context.repository_path, context.refactorings, context.catalog)
+
+
+# Name -> factory of every family, in the order they receive the commits
+FAMILIES = {}
+
+
+def register(name, factory):
+    FAMILIES[name] = factory
+
+
+register('comm_own', comm_own_family)
+register('minor_exp', minor_exp_family)
+register('nd_sexp', nd_sexp_family)
+
+
+def run_fused(repository_path, refactorings_file_path, project_path, families=None, refactorings=None):
+    """
+    Compute the metric families of a repository in one traversal and save their results
+    Input: repository_path: str
+           refactorings_file_path: str, only_refactorings.json of the repository
+           project_path: str, folder of the part_1b and part_2 result files
+           families: list of str or None, names from FAMILIES (all of them by default)
+           refactorings: RefactoringIndex or None, read from the commit catalog when not given
+    Output: dict {family name: path of the saved file}
+    """
+    print(f"Processing repository: {repository_path}")
+    context = RepositoryContext(repository_path, refactorings_file_path, refactorings)
+    total_commits = context.catalog.count()
+    plugins = {name: FAMILIES[name](context) for name in (families or FAMILIES)}
+    context.catalog.close()
+
+    # Every family sees the same commits and the same file IDs
+    file_ids = FileIds()
+    # A run that was stopped goes on from its last checkpoint, if it computed the same families,
+    # and an incremental run from the end of the last one
+    checkpointer = Checkpointer(checkpoint_path(context.project_folder, 'fused_' + '_'.join(plugins)))
+    state = checkpointer.load()
+    if state is not None:
+        file_ids = state["file_ids"]
+        for name, plugin in plugins.items():
+            plugin.restore(state["families"][name])
+    repository = iter_log(repository_path, rev=checkpointer.revisions(repository_path))
+    get_state = lambda: {"file_ids": file_ids, "families": {name: plugin.state() for name, plugin in plugins.items()}}
+    if not total_commits == 0:
+        for i, commit in checkpointer.skip(repository):
+            progress = (i+1)/total_commits*100
+            if i == 0 or (total_commits >= 4 and (i+1) % (total_commits // 4) == 0) or (i+1) == total_commits:
+                print(f"Processing commit {i+1}/{total_commits} ({progress:.2f}%)")
+            ids = file_ids.commit_ids(commit)
+            for plugin in plugins.values():
+                plugin.process_commit(commit, ids)
+            checkpointer.step(i, commit.hash, get_state)
+
+    saved = {}
+    for name, plugin in plugins.items():
+        metrics = plugin.finish()
+        if metrics is None:
+            print(f"No {name} metrics for {context.project_name}")
+            continue
+        saved[name] = plugin.output_file(project_path)
+        save_metrics(metrics, saved[name])
+        print(f"Metrics saved to {saved[name]}")
+    context.blame.close()
+    # Kept once the results are saved, so a stop in between only redoes the new commits
+    checkpointer.finish(get_state)
+    return saved
+
+
+def main():
+    repository_path, refactorings_file_path, project_path = collect_process_settings()
+    run_fused(repository_path, refactorings_file_path, project_path)
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,9 @@ export NUM_THREADS=$SLURM_CPUS_PER_TASK
 # Define paths
 export PROJAPPL_DIR="/projappl/project_2011410" # Project application directory
 export SCRATCH_DIR="/scratch/project_2011410" # Scratch directory on Puhti
+export REPO_CACHE_DIR="$SCRATCH_DIR/repo_cache" # Bare mirrors shared by all the pipeline stages
+export CHECKPOINT_INTERVAL=900 # Seconds between two checkpoints of a metric traversal, a resubmitted job resumes from them
+export INCREMENTAL=0 # 1 keeps the final state of every project and only analyses its new commits on the next run
 
 # Change directory to your project directory
 cd /scratch/project_2011410
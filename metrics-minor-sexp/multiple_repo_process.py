@@ -3,25 +3,30 @@
     # A project has the git repository cloned, and the refactorings.json file created
     # Create the only_refactorings.json file with the create_only_refactorings_file function (if the file already exists, the function call doesn't do anything)
     # Run the metrics_nicolas_reformed.py with the paths to the only_refactorings.json file and the project folder
+    # (all the metric families are computed in one traversal of the repository, see fused_metrics.py)
 
-import os, subprocess
+import os, sys
 from pathlib import Path
-from calc_1b_metrics import full_repo_analysis_bu
 from clean_refactoring_output import create_only_refactorings_file
-from calc_2_metrics import full_repo_analysis
+from fused_metrics import run_fused
+
+# The shared helpers live at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import repo_cache
+from checkpoints import INCREMENTAL
 
 
 def clone_project(project_url:str, project_name:str, project_folder:str):
     cloned_repo_path = os.path.join(project_folder, project_name).rstrip()
     if not Path(cloned_repo_path).exists(): # Check if the project is already cloned
         print(f"Cloning project: {project_name} (into {cloned_repo_path})")
-        subprocess.run(["git", "clone", project_url, cloned_repo_path], check=True)
+        repo_cache.checkout(project_url, cloned_repo_path)
     return cloned_repo_path
 
 def remove_project(project_folder:str):
     if Path(project_folder).exists():
         try:
-            subprocess.run(["rm", "-rf", project_folder], check=True)
+            repo_cache.release(project_folder)
         except:
             print(f"Error removing project folder: {project_folder}")
 
@@ -41,6 +46,10 @@ def main():
         project_name = project_url.split('/')[-1].replace('.git', '').rstrip()
         print(f"Processing project: {project_name} ({(cpt+1)*100/total_projects:.2f}%)")
         current_project_folder = os.path.join(project_folder, project_name)        
+        # A resubmitted job skips the projects it already finished, unless it refreshes them incrementally
+        if not INCREMENTAL and all(Path(project_folder, f"{project_name}-{part}_metrics.json").exists() for part in ('part_1b', 'part_2')):
+            print(f"Metrics already computed for project: {project_name}")
+            continue
         if not Path(current_project_folder).exists():
             os.mkdir(current_project_folder)
         try:
@@ -55,8 +64,8 @@ def main():
             remove_project(cloned_repo_path)
             continue
 
-        #full_repo_analysis(cloned_repo_path, ref_com_file_path, project_folder)
-        full_repo_analysis_bu(cloned_repo_path, ref_com_file_path, project_folder)
+        # COMM-OWN, MINOR-EXP and ND-SEXP out of a single traversal of the history
+        run_fused(cloned_repo_path, ref_com_file_path, project_folder)
         remove_project(cloned_repo_path)
     
     print("All projects processed")
@@ -0,0 +1,127 @@
+# Inverted index from file path to the commits that touched it.
+# The history of a repository is read once with git log and linearized (parents before
+# children). Every normalized path gets a postings list of (position, author email,
+# added lines, deleted lines) sorted by position, with prefix sums of the line counts,
+# so the activity of a file over a window of commits is a bisect plus two subtractions
+# instead of a rescan of the history for every file. The same postings are also kept by
+# file ID (see file_ids.py), so a file can be followed across its renames.
+
+import os
+from bisect import bisect_left, bisect_right
+
+from git_log_parser import iter_log
+from file_ids import FileIds
+
+
+def normalize_path(path):
+    # Same normalization as is_same_path in metrics-comm-own.py
+    if not path.startswith('/') and not path.startswith('\\'):
+        path = '/' + path
+    return os.path.normpath(path)
+
+
+class _Postings:
+    __slots__ = ('positions', 'emails', 'added', 'deleted')
+
+    def __init__(self):
+        self.positions = []
+        self.emails = []
+        # Prefix sums: added[i] is the number of lines added by the first i postings
+        self.added = [0]
+        self.deleted = [0]
+
+    def append(self, position, email, added_lines, deleted_lines):
+        self.positions.append(position)
+        self.emails.append(email)
+        self.added.append(self.added[-1] + added_lines)
+        self.deleted.append(self.deleted[-1] + deleted_lines)
+
+
+class PathIndex:
+    """Path -> commit postings of a repository, with commit positions in topological order."""
+
+    def __init__(self, commits=()):
+        """
+        Input: commits: iterable of git_log_parser.CommitRecord (or pydriller Commit), parents before children
+        """
+        self.hashes = []
+        self.positions = {}
+        self.postings = {}
+        self.file_postings = []
+        self.file_ids = FileIds()
+        self.file_ids.record = True
+        for commit in commits:
+            self.add_commit(commit)
+
+    def add_commit(self, commit):
+        # Appends the next commit of the history (a CommitRecord or a pydriller Commit)
+        position = len(self.hashes)
+        self.hashes.append(commit.hash)
+        self.positions[commit.hash] = position
+        for mod in commit.modified_files:
+            self._add(position, commit.hash, commit.author.email, mod.old_path, mod.new_path,
+                      mod.change_type.name, mod.added_lines, mod.deleted_lines)
+
+    def _add(self, position, commit_hash, email, old_path, new_path, change_type, added_lines, deleted_lines):
+        paths = {normalize_path(path) for path in (new_path, old_path) if path is not None}
+        # A rename is counted for both of its paths, once per commit and path
+        for path in paths:
+            postings = self.postings.get(path)
+            if postings is None:
+                postings = self.postings[path] = _Postings()
+            postings.append(position, email, added_lines, deleted_lines)
+        # and once for the file it belongs to
+        file_id = self.file_ids.assign(commit_hash, old_path, new_path, change_type)
+        if file_id == len(self.file_postings):
+            self.file_postings.append(_Postings())
+        self.file_postings[file_id].append(position, email, added_lines, deleted_lines)
+
+    @classmethod
+    def build(cls, repo_path):
+        # --topo-order keeps every commit after its parents, so a window of positions
+        # between two commits holds the history in between
+        return cls(iter_log(repo_path, extra_args=['--topo-order']))
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        # Same index out of a commit_catalog.CommitCatalog, without reading the history again
+        index = cls()
+        index.positions = catalog.positions()
+        index.hashes = [None] * len(index.positions)
+        for commit_hash, position in index.positions.items():
+            index.hashes[position] = commit_hash
+        for change in catalog.file_changes():
+            index._add(*change)
+        return index
+
+    def position(self, commit_hash):
+        return self.positions.get(commit_hash)
+
+    def query(self, path, start=0, end=None, commit_hash=None):
+        """
+        Activity of a file between two commit positions, both included, given in either order
+        like pydriller's from_commit and to_commit
+        Input: path: str, path of the file (normalized here)
+               start: int, position of one end of the window
+               end: int or None, position of the other end (defaults to the last commit)
+               commit_hash: str or None, a commit touching the file at this path. When given,
+                            the file is followed across its renames instead of matching the path.
+        Output: (number of commits, set of author emails, added lines, deleted lines)
+        """
+        file_id = self.file_ids.file_id(commit_hash, path) if commit_hash else None
+        if file_id is not None:
+            postings = self.file_postings[file_id]
+        else:
+            postings = self.postings.get(normalize_path(path))
+        if end is None:
+            end = len(self.hashes) - 1
+        if start > end:
+            start, end = end, start
+        if postings is None:
+            return 0, set(), 0, 0
+        lo = bisect_left(postings.positions, start)
+        hi = bisect_right(postings.positions, end)
+        return (hi - lo,
+                set(postings.emails[lo:hi]),
+                postings.added[hi] - postings.added[lo],
+                postings.deleted[hi] - postings.deleted[lo])
@@ -0,0 +1,67 @@
+# Refactoring commits of a repository, read once per repository.
+# The metric scripts used to keep the refactoring hashes in a list attached to the function
+# is_a_refactoring_commit: every lookup scanned the list, and the list had to be deleted
+# between two repositories, so a process could only analyse one repository at a time.
+# A RefactoringIndex belongs to one repository and is passed along with its traversal. It
+# is not changed once built, so threads can share it and it pickles to worker processes.
+
+from collections import Counter
+
+from refactorings_reader import iter_refactoring_commits
+
+
+class RefactoringIndex:
+    """Refactoring commits of a repository, with the types and counts of their refactorings."""
+
+    def __init__(self, types=None):
+        """
+        Input: types: dict {commit hash: {refactoring type: count}} of the refactoring commits
+        """
+        self.types = types or {}
+        # refactoring type -> hashes of the commits with such a refactoring
+        self.by_type = {}
+        for commit_hash, commit_types in self.types.items():
+            for kind in commit_types:
+                self.by_type.setdefault(kind, set()).add(commit_hash)
+
+    @classmethod
+    def from_file(cls, refactorings_file):
+        """
+        Input: refactorings_file: str, refactorings.json or only_refactorings.json
+        Output: RefactoringIndex
+        """
+        types = {}
+        for commit in iter_refactoring_commits(refactorings_file):
+            counts = types.setdefault(commit['sha1'], Counter())
+            counts.update(refactoring['type'] for refactoring in commit['refactorings'])
+        return cls({commit_hash: dict(counts) for commit_hash, counts in types.items()})
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """
+        Same index out of a commit catalog, which read the refactorings file when it was built
+        Input: catalog: CommitCatalog
+        Output: RefactoringIndex
+        """
+        return cls(catalog.refactoring_counts())
+
+    def __len__(self):
+        return len(self.types)
+
+    def __contains__(self, commit_hash):
+        return commit_hash in self.types
+
+    def is_refactoring(self, commit_hash):
+        return commit_hash in self.types
+
+    def commits_of_type(self, kind):
+        """Hashes of the commits with a refactoring of the given type, e.g. 'Extract Method'."""
+        return self.by_type.get(kind, set())
+
+    def refactoring_types(self, commit_hash):
+        """{refactoring type: count} of a commit, empty when it is not a refactoring commit."""
+        return self.types.get(commit_hash, {})
+
+    def count(self, commit_hash):
+        """Number of refactorings of a commit."""
+        return sum(self.types.get(commit_hash, {}).values())
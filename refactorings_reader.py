@@ -0,0 +1,219 @@
+# Incremental reader for the refactorings.json files written by RefactoringMiner.
+# The files are shaped like {"commits": [{...}, {...}, ...]} and can be several
+# gigabytes large, so instead of json.load-ing them whole, the commits array is
+# decoded one object at a time. Peak memory is bounded by the largest commit.
+
+import json
+import os
+import textwrap
+
+CHUNK_SIZE = 1 << 20 # Number of characters read from the file at a time
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class _Stream:
+    """Character buffer over a file that only keeps the not yet decoded part."""
+
+    def __init__(self, file):
+        self.file = file
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=CHUNK_SIZE):
+        # Drop what has already been consumed before reading more
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        chunk = self.file.read(size)
+        if not chunk:
+            self.eof = True
+        self.buf += chunk
+        return bool(chunk)
+
+    def peek(self):
+        # Return the next non-whitespace character without consuming it
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def decode(self):
+        # Decode the next JSON value, reading more of the file until it is complete
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow the read size with the value so big commits are not re-parsed too often
+            self.fill(max(CHUNK_SIZE, len(self.buf) - self.pos))
+
+
+def iter_commits(file_path, encoding='utf-8'):
+    """
+    Yield the commit objects of a refactorings.json file one at a time
+    Input: file_path: str
+           encoding: str
+    Output: generator of dict
+    """
+    with open(file_path, 'r', encoding=encoding) as file:
+        stream = _Stream(file)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            key = stream.decode()
+            stream.expect(':')
+            if key == 'commits':
+                stream.expect('[')
+                if stream.peek() == ']':
+                    stream.pos += 1
+                else:
+                    while True:
+                        yield stream.decode()
+                        if stream.peek() == ',':
+                            stream.pos += 1
+                            continue
+                        stream.expect(']')
+                        break
+            else:
+                # Skip any other top-level value
+                stream.decode()
+            if stream.peek() == ',':
+                stream.pos += 1
+                continue
+            stream.expect('}')
+            return
+
+
+def iter_array(file_path, encoding='utf-8'):
+    """
+    Yield the items of a file holding a top-level JSON array (e.g. commits.json) one at a time
+    Input: file_path: str
+           encoding: str
+    Output: generator
+    """
+    with open(file_path, 'r', encoding=encoding) as file:
+        stream = _Stream(file)
+        stream.expect('[')
+        if stream.peek() == ']':
+            return
+        while True:
+            yield stream.decode()
+            if stream.peek() == ',':
+                stream.pos += 1
+                continue
+            stream.expect(']')
+            return
+
+
+def iter_refactoring_commits(file_path, encoding='utf-8'):
+    """
+    Yield only the commits of a refactorings.json file that contain refactorings
+    Input: file_path: str
+           encoding: str
+    Output: generator of dict
+    """
+    for commit in iter_commits(file_path, encoding):
+        if commit.get('refactorings'):
+            yield commit
+
+
+class JsonArrayWriter:
+    """
+    Write {"<key>": [item, item, ...]} to a file one item at a time, with the
+    same layout json.dump would produce for the whole object.
+    """
+
+    def __init__(self, file, key, indent=None):
+        self.file = file
+        self.indent = indent
+        self.count = 0
+        if indent is None:
+            file.write('{' + json.dumps(key) + ': [')
+        else:
+            file.write('{\n' + ' ' * indent + json.dumps(key) + ': [')
+
+    def write(self, item):
+        if self.indent is None:
+            self.file.write(', ' if self.count else '')
+            self.file.write(json.dumps(item))
+        else:
+            self.file.write(',\n' if self.count else '\n')
+            self.file.write(textwrap.indent(json.dumps(item, indent=self.indent), ' ' * 2 * self.indent))
+        self.count += 1
+
+    def close(self):
+        if self.indent is None or not self.count:
+            self.file.write(']}' if self.indent is None else ']\n}')
+        else:
+            self.file.write('\n' + ' ' * self.indent + ']\n}')
+
+
+def filter_refactorings(input_file, only_refactorings_file=None, sha1_file=None,
+                        indent=None, encoding='utf-8'):
+    """
+    Stream refactorings.json once and write the commits that have refactorings
+    to only_refactorings_file and/or their sha1 values to sha1_file
+    Input: input_file: str
+           only_refactorings_file: str or None ({"commits": [...]})
+           sha1_file: str or None ({"sha1_values": [...]}, always indented by 4)
+           indent: int or None, indentation of only_refactorings_file
+           encoding: str
+    Output: (number of commits, number of commits with refactorings)
+    """
+    output_files = [f for f in (only_refactorings_file, sha1_file) if f]
+    outputs = []
+    writers = []
+    try:
+        if only_refactorings_file:
+            outputs.append(open(only_refactorings_file, 'w'))
+            commits_writer = JsonArrayWriter(outputs[-1], 'commits', indent)
+            writers.append(commits_writer)
+        if sha1_file:
+            outputs.append(open(sha1_file, 'w'))
+            sha1_writer = JsonArrayWriter(outputs[-1], 'sha1_values', 4)
+            writers.append(sha1_writer)
+
+        total = 0
+        kept = 0
+        for commit in iter_commits(input_file, encoding):
+            total += 1
+            if not commit.get('refactorings'):
+                continue
+            kept += 1
+            if only_refactorings_file:
+                commits_writer.write(commit)
+            if sha1_file:
+                sha1_writer.write(commit['sha1'])
+
+        for writer in writers:
+            writer.close()
+    except:
+        # Do not leave truncated outputs behind, they would be taken as complete later
+        for output in outputs:
+            output.close()
+        for output_file in output_files:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+        raise
+    finally:
+        for output in outputs:
+            output.close()
+    return total, kept
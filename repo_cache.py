@@ -0,0 +1,202 @@
+# Shared cache of bare repository mirrors used by the mining, CK and process metric scripts.
+# Each project is cloned from GitHub only once into a bare mirror, later runs refresh it
+# with a fetch, and the scripts work on cheap local clones of the mirror that they can
+# delete freely. Mirrors that were not used for the longest time are evicted when the
+# cache grows over its disk quota.
+
+import os
+import shutil
+import stat
+import subprocess
+import threading
+import time
+
+import telemetry # Child processes are measured when run inside a pipeline stage
+
+try:
+    import fcntl # Cross-process locking, not available on Windows
+except ImportError:
+    fcntl = None
+
+# Directory holding the bare mirrors
+CACHE_DIR = os.getenv('REPO_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'repo_cache'))
+# Disk quota of the cache in GB, no eviction when unset
+QUOTA_GB = os.getenv('REPO_CACHE_QUOTA_GB')
+
+LAST_USED_FILE = 'cache-last-used'
+LOCK_FILE = 'cache.lock'
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def remove_readonly(func, path, _):
+    "Clear the readonly bit and reattempt the removal"
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+
+def project_name(link):
+    # Extract the repository name from the link
+    name = link.rstrip('/').split('/')[-1]
+    return name[:-4] if name.endswith('.git') else name
+
+
+def mirror_path(link, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, project_name(link) + '.git')
+
+
+class _MirrorLock:
+    """Lock a mirror against other threads and, where possible, other processes."""
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self.file = None
+        with _thread_locks_guard:
+            self.thread_lock = _thread_locks.setdefault(path, threading.Lock())
+
+    def acquire(self):
+        if not self.thread_lock.acquire(self.blocking):
+            return False
+        if fcntl is None:
+            return True
+        self.file = open(self.path + '.' + LOCK_FILE, 'w')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | (0 if self.blocking else fcntl.LOCK_NB))
+        except OSError:
+            self.file.close()
+            self.file = None
+            self.thread_lock.release()
+            return False
+        return True
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _touch(path):
+    # Record the last time a mirror was handed out, used for the LRU eviction
+    with open(os.path.join(path, LAST_USED_FILE), 'w') as file:
+        file.write(str(time.time()))
+
+
+def _last_used(path):
+    try:
+        with open(os.path.join(path, LAST_USED_FILE), 'r') as file:
+            return float(file.read().strip())
+    except (OSError, ValueError):
+        return 0.0
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def ensure_mirror(link, cache_dir=None, refresh=True):
+    """
+    Create the bare mirror of a repository, or fetch it when it already exists
+    Input: link: str, URL of the repository
+           cache_dir: str or None, defaults to $REPO_CACHE_DIR
+           refresh: bool, fetch new commits into an existing mirror
+    Output: str, path of the mirror
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    path = mirror_path(link, cache_dir)
+    with _MirrorLock(path):
+        if not os.path.exists(os.path.join(path, 'HEAD')):
+            if os.path.exists(path):
+                shutil.rmtree(path, onerror=remove_readonly)
+            print(f"Cloning {link} into the repository cache ({path})")
+            telemetry.run(["git", "clone", "--bare", link, path], check=True)
+            # Keep branches and tags up to date on fetch, like a mirror without the pull request refs
+            subprocess.run(["git", "-C", path, "config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"], check=True)
+        elif refresh:
+            telemetry.run(["git", "-C", path, "fetch", "--prune", "--tags", "origin"], check=True)
+        _touch(path)
+    evict(cache_dir, keep=(path,))
+    return path
+
+
+def checkout(link, dest, cache_dir=None, refresh=True):
+    """
+    Make a working copy of a repository out of its cached mirror
+    Input: link: str, URL of the repository
+           dest: str, where the working copy is created
+           cache_dir: str or None, defaults to $REPO_CACHE_DIR
+           refresh: bool, fetch new commits into an existing mirror first
+    Output: str, dest
+    """
+    path = ensure_mirror(link, cache_dir, refresh)
+    with _MirrorLock(path):
+        # --local hardlinks the objects when the mirror is on the same file system,
+        # and the copy stays usable if the mirror is evicted later on
+        telemetry.run(["git", "clone", "--local", path, dest], check=True)
+        _touch(path)
+    # Point the working copy back to the real remote
+    subprocess.run(["git", "-C", dest, "remote", "set-url", "origin", link], check=True)
+    return dest
+
+
+def release(dest):
+    """Remove a working copy handed out by checkout, the mirror stays in the cache."""
+    if os.path.exists(dest):
+        shutil.rmtree(dest, onerror=remove_readonly)
+
+
+def evict(cache_dir=None, quota_bytes=None, keep=()):
+    """
+    Remove the least recently used mirrors until the cache fits its quota.
+    Mirrors that are being cloned or fetched at the moment are never removed.
+    Input: cache_dir: str or None, defaults to $REPO_CACHE_DIR
+           quota_bytes: int or None, defaults to $REPO_CACHE_QUOTA_GB
+           keep: paths of mirrors that must not be removed
+    Output: list of removed mirror paths
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    if quota_bytes is None:
+        if not QUOTA_GB:
+            return []
+        quota_bytes = int(float(QUOTA_GB) * 1024 ** 3)
+
+    mirrors = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+               if name.endswith('.git') and os.path.isdir(os.path.join(cache_dir, name))]
+    sizes = {path: _dir_size(path) for path in mirrors}
+    total = sum(sizes.values())
+
+    removed = []
+    for path in sorted(mirrors, key=_last_used):
+        if total <= quota_bytes:
+            break
+        if path in keep:
+            continue
+        lock = _MirrorLock(path, blocking=False)
+        if not lock.acquire():
+            continue
+        try:
+            print(f"Evicting {path} from the repository cache")
+            shutil.rmtree(path, onerror=remove_readonly)
+        finally:
+            lock.release()
+        total -= sizes[path]
+        removed.append(path)
+    return removed
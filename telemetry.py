@@ -0,0 +1,213 @@
+# Per-repository stage telemetry of the mining pipeline.
+# Every stage a repository goes through (clone, RefactoringMiner, commit collection,
+# cleanup) appends one JSON line to $TELEMETRY_FILE with its wall time, the CPU time
+# of the thread running it, the CPU time and peak RSS of the child processes it
+# started through run(), the bytes it added to its output paths and its exit status.
+#
+# Summary of a finished or running job:
+#   python telemetry.py [telemetry.jsonl] [number of repositories to list]
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# JSONL file the stage records are appended to. Telemetry is off unless it is set, e.g. by job.sh
+TELEMETRY_FILE = os.getenv('TELEMETRY_FILE', '')
+
+_write_lock = threading.Lock()
+_record_lock = threading.Lock()
+_current = threading.local()
+
+
+def _dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _emit(record):
+    if not TELEMETRY_FILE:
+        return
+    line = json.dumps(record) + '\n'
+    with _write_lock:
+        with open(TELEMETRY_FILE, 'a') as file:
+            file.write(line)
+
+
+@contextmanager
+def stage(repo, name, paths=(), **extra):
+    """
+    Measure one stage of a repository and append its record to the telemetry file
+    Input: repo: str, link or name of the repository
+           name: str, stage name (clone, miner, collect, cleanup, ...)
+           paths: files or folders the stage writes to, their growth is reported as bytes_written
+           extra: more fields stored as they are (heap_mb, attempt, ...)
+    Output: the record dict, the stage can set record['status'] or add fields to it
+    """
+    record = {
+        'repo': repo,
+        'stage': name,
+        'start': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'status': 'ok',
+        'children': 0,
+        'exit_codes': [],
+        'child_cpu_s': 0.0,
+        'child_peak_rss_mb': 0.0,
+    }
+    record.update(extra)
+    sizes_before = [_dir_size(path) if os.path.exists(path) else 0 for path in paths]
+    wall_start = time.monotonic()
+    cpu_start = time.thread_time()
+    previous = getattr(_current, 'record', None)
+    _current.record = record
+    try:
+        yield record
+    except BaseException as e:
+        record['status'] = f'error: {type(e).__name__}: {e}'
+        raise
+    finally:
+        _current.record = previous
+        record['wall_s'] = round(time.monotonic() - wall_start, 3)
+        record['cpu_s'] = round(time.thread_time() - cpu_start, 3)
+        record['child_cpu_s'] = round(record['child_cpu_s'], 3)
+        sizes_after = [_dir_size(path) if os.path.exists(path) else 0 for path in paths]
+        record['bytes_written'] = sum(max(0, after - before) for before, after in zip(sizes_before, sizes_after))
+        _emit(record)
+
+
+def bind(function):
+    """Wrap a function so that it reports to the stage of the calling thread when run in another thread."""
+    record = getattr(_current, 'record', None)
+
+    def wrapper(*args, **kwargs):
+        previous = getattr(_current, 'record', None)
+        _current.record = record
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.record = previous
+    return wrapper
+
+
+def run(args, check=False, **kwargs):
+    """
+    subprocess.run replacement that charges the CPU time and peak RSS of the child
+    to the stage running in the current thread
+    Input: same as subprocess.run (input and capture_output are not supported)
+    Output: subprocess.CompletedProcess
+    """
+    record = getattr(_current, 'record', None)
+    # os.wait4 is not available on Windows
+    if record is None or not hasattr(os, 'wait4'):
+        return subprocess.run(args, check=check, **kwargs)
+
+    process = subprocess.Popen(args, **kwargs)
+    try:
+        # wait4 returns the resource usage of this very child (and of the processes it
+        # waited for), unlike getrusage(RUSAGE_CHILDREN) that mixes up all the threads
+        _, status, usage = os.wait4(process.pid, 0)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    process.returncode = os.waitstatus_to_exitcode(status)
+    with _record_lock:
+        record['children'] += 1
+        record['exit_codes'].append(process.returncode)
+        record['child_cpu_s'] += usage.ru_utime + usage.ru_stime
+        # ru_maxrss is in KB on Linux
+        record['child_peak_rss_mb'] = max(record['child_peak_rss_mb'], round(usage.ru_maxrss / 1024, 1))
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args)
+    return subprocess.CompletedProcess(args, process.returncode)
+
+
+def call(args, **kwargs):
+    """Same as subprocess.call, measured like run()."""
+    return run(args, **kwargs).returncode
+
+
+def load_records(file_path):
+    records = []
+    with open(file_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # The last line may be cut if the job was killed while writing it
+                pass
+    return records
+
+
+def summarize(records, top=10):
+    """
+    Rank the repositories of a telemetry file
+    Input: records: list of dict, as returned by load_records
+           top: int, number of repositories in each ranking
+    Output: dict with the per-stage totals and the slowest / most memory-hungry repositories
+    """
+    stages = {}
+    repos = {}
+    for record in records:
+        totals = stages.setdefault(record['stage'], {'runs': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'child_cpu_s': 0.0,
+                                                     'peak_rss_mb': 0.0, 'failures': 0})
+        totals['runs'] += 1
+        totals['wall_s'] += record.get('wall_s', 0.0)
+        totals['cpu_s'] += record.get('cpu_s', 0.0)
+        totals['child_cpu_s'] += record.get('child_cpu_s', 0.0)
+        totals['peak_rss_mb'] = max(totals['peak_rss_mb'], record.get('child_peak_rss_mb', 0.0))
+        if record.get('status') not in ('ok', 'done'):
+            totals['failures'] += 1
+
+        repo = repos.setdefault(record['repo'], {'repo': record['repo'], 'wall_s': 0.0, 'cpu_s': 0.0,
+                                                 'peak_rss_mb': 0.0, 'bytes_written': 0, 'stages': {}})
+        repo['wall_s'] += record.get('wall_s', 0.0)
+        repo['cpu_s'] += record.get('cpu_s', 0.0) + record.get('child_cpu_s', 0.0)
+        repo['peak_rss_mb'] = max(repo['peak_rss_mb'], record.get('child_peak_rss_mb', 0.0))
+        repo['bytes_written'] += record.get('bytes_written', 0)
+        # Retried stages (e.g. RefactoringMiner after an OutOfMemoryError) add up
+        repo['stages'][record['stage']] = repo['stages'].get(record['stage'], 0.0) + record.get('wall_s', 0.0)
+
+    repos = list(repos.values())
+    return {
+        'stages': stages,
+        'slowest': sorted(repos, key=lambda repo: repo['wall_s'], reverse=True)[:top],
+        'most_memory': sorted(repos, key=lambda repo: repo['peak_rss_mb'], reverse=True)[:top],
+    }
+
+
+def print_summary(summary):
+    print(f"{'Stage':<12}{'Runs':>8}{'Wall (h)':>12}{'CPU (h)':>12}{'Child CPU (h)':>16}{'Peak RSS (GB)':>16}{'Failed':>8}")
+    for name, totals in summary['stages'].items():
+        print(f"{name:<12}{totals['runs']:>8}{totals['wall_s'] / 3600:>12.2f}{totals['cpu_s'] / 3600:>12.2f}"
+              f"{totals['child_cpu_s'] / 3600:>16.2f}{totals['peak_rss_mb'] / 1024:>16.1f}{totals['failures']:>8}")
+
+    print("\nSlowest repositories")
+    for repo in summary['slowest']:
+        stages = ', '.join(f"{name} {wall / 60:.1f} min" for name, wall in repo['stages'].items())
+        print(f"  {repo['wall_s'] / 60:>9.1f} min  {repo['repo']}  ({stages})")
+
+    print("\nMost memory-hungry repositories")
+    for repo in summary['most_memory']:
+        print(f"  {repo['peak_rss_mb'] / 1024:>9.1f} GB   {repo['repo']}  "
+              f"(CPU {repo['cpu_s'] / 3600:.2f} h, {repo['bytes_written'] / 1024 ** 2:.0f} MB written)")
+
+
+if __name__ == "__main__":
+    file_path = sys.argv[1] if len(sys.argv) > 1 else TELEMETRY_FILE or 'telemetry.jsonl'
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print_summary(summarize(load_records(file_path), top))